@@ -1,13 +1,12 @@
 import asyncio
 import logging
-from aiogram import Bot
 from aiogram.fsm.context import FSMContext
 
 logger = logging.getLogger(__name__)
 
 class TelethonAuthHandler:
-    def __init__(self, bot: Bot, admin_id: int):
-        self.bot = bot
+    def __init__(self, notifier, admin_id: int):
+        self.notifier = notifier
         self.admin_id = admin_id
         self.phone_future = None
         self.code_future = None
@@ -36,14 +35,12 @@ class TelethonAuthHandler:
         self.prompt_admin_ids = None
 
         logger.info(f"Requesting phone from admins: {target_admin_ids}")
-        for admin_id in target_admin_ids:
-            await self.bot.send_message(
-                admin_id,
-                "📱 <b>Авторизация Telethon</b>\n\n"
-                "Отправьте ваш номер телефона в международном формате.\n"
-                "Пример: +79991234567",
-                parse_mode="HTML"
-            )
+        await self.notifier.broadcast_and_wait(
+            "📱 <b>Авторизация Telethon</b>\n\n"
+            "Отправьте ваш номер телефона в международном формате.\n"
+            "Пример: +79991234567",
+            target_admin_ids
+        )
         
         phone = await self.phone_future
         logger.info(f"Phone received: {phone[:5]}***")
@@ -53,11 +50,10 @@ class TelethonAuthHandler:
         self.code_future = asyncio.Future()
 
         logger.info(f"Requesting code from admin_id={self.admin_id}")
-        await self.bot.send_message(
+        await self.notifier.send_and_wait(
             self.admin_id,
             "🔐 <b>Код подтверждения</b>\n\n"
-            "Отправьте код, который пришел вам в Telegram.",
-            parse_mode="HTML"
+            "Отправьте код, который пришел вам в Telegram."
         )
         
         code = await self.code_future
@@ -68,12 +64,11 @@ class TelethonAuthHandler:
         self.password_future = asyncio.Future()
 
         logger.info(f"Requesting 2FA password from admin_id={self.admin_id}")
-        await self.bot.send_message(
+        await self.notifier.send_and_wait(
             self.admin_id,
             "🔒 <b>Двухфакторная аутентификация</b>\n\n"
             "Отправьте ваш пароль 2FA.\n\n"
-            "⚠️ Сообщение с паролем будет автоматически удалено!",
-            parse_mode="HTML"
+            "⚠️ Сообщение с паролем будет автоматически удалено!"
         )
         
         password = await self.password_future
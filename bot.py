@@ -10,9 +10,10 @@ import config
 from database import Database
 from checker import UsernameChecker
 from handlers import router
+from notifier import NotificationDispatcher, OutboxWorker
 from utils import setup_logging
 from auth_handler import TelethonAuthHandler
-from telethon_auth import authorize_telethon, ensure_authorized
+from telethon_auth import authorize_telethon, ensure_authorized, connect_extra_sessions
 
 logger = logging.getLogger(__name__)
 auth_handler = None
@@ -34,18 +35,28 @@ async def main():
     await db.init_db()
     logger.info("Database initialized")
     
-    bot = Bot(
-        token=config.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
+    # Все токены отправляют уведомления, первый бот принимает обновления
+    bots = [
+        Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        for token in config.BOT_TOKENS
+    ]
+    bot = bots[0]
+    
+    notifier = NotificationDispatcher(bots)
+    notifier.start()
+    # Доставка уведомлений из outbox не зависит от мониторинга: после
+    # перезапуска сразу уходят неотправленные
+    outbox = OutboxWorker(db, notifier)
+    outbox.start()
     
     global auth_handler
-    auth_handler = TelethonAuthHandler(bot, config.ADMIN_ID)
+    auth_handler = TelethonAuthHandler(notifier, config.ADMIN_ID)
     
     checker = UsernameChecker(
         api_id=config.API_ID,
         api_hash=config.API_HASH,
-        session_name=config.SESSION_NAME
+        session_name=config.SESSION_NAME,
+        extra_session_names=config.EXTRA_SESSION_NAMES
     )
     
     dp = Dispatcher()
@@ -79,8 +90,11 @@ async def main():
     @router.message.middleware()
     async def inject_dependencies(handler, event, data):
         prompt_admin_id = event.from_user.id if event.from_user else None
+        if prompt_admin_id is not None:
+            # Пользователь пишет боту - значит, снова принимает сообщения
+            notifier.unblock(prompt_admin_id)
         is_authorized = await ensure_authorized(
-            bot,
+            notifier,
             checker,
             auth_handler,
             config.ADMIN_IDS,
@@ -92,18 +106,23 @@ async def main():
             else:
                 await event.answer("🔐 Требуется авторизация Telethon. Следуйте инструкциям бота.")
             return
-
+        
         data['db'] = db
         data['checker'] = checker
         data['bot'] = bot
+        data['notifier'] = notifier
+        data['outbox'] = outbox
         data['auth_handler'] = auth_handler
         return await handler(event, data)
     
     @router.callback_query.middleware()
     async def inject_dependencies_callback(handler, event, data):
         prompt_admin_id = event.from_user.id if event.from_user else None
+        if prompt_admin_id is not None:
+            # Пользователь пишет боту - значит, снова принимает сообщения
+            notifier.unblock(prompt_admin_id)
         is_authorized = await ensure_authorized(
-            bot,
+            notifier,
             checker,
             auth_handler,
             config.ADMIN_IDS,
@@ -115,16 +134,19 @@ async def main():
             else:
                 await event.answer("🔐 Требуется авторизация Telethon. Следуйте инструкциям бота.", show_alert=True)
             return
-
+        
         data['db'] = db
         data['checker'] = checker
         data['bot'] = bot
+        data['notifier'] = notifier
+        data['outbox'] = outbox
         data['auth_handler'] = auth_handler
         return await handler(event, data)
     
     auth_task = asyncio.create_task(
-        authorize_telethon(bot, checker, auth_handler, config.ADMIN_IDS)
+        authorize_telethon(notifier, checker, auth_handler, config.ADMIN_IDS)
     )
+    extra_sessions_task = asyncio.create_task(connect_extra_sessions(checker))
     
     global current_token_index
     max_retries = len(config.BOT_TOKENS) if len(config.BOT_TOKENS) > 1 else 1
@@ -140,26 +162,15 @@ async def main():
             
             if len(config.BOT_TOKENS) > 1 and retry_after > 10:
                 current_token_index = (current_token_index + 1) % len(config.BOT_TOKENS)
-                new_token = config.BOT_TOKENS[current_token_index]
-                logger.info(f"Switching to backup token #{current_token_index + 1}")
+                logger.info(f"Switching polling to backup token #{current_token_index + 1}")
                 
-                await bot.session.close()
-                bot = Bot(
-                    token=new_token,
-                    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-                )
-                auth_handler.bot = bot
+                # Боты пула продолжают отправлять уведомления, меняется только бот для polling
+                bot = bots[current_token_index]
                 
-                for admin_id in config.ADMIN_IDS:
-                    try:
-                        await bot.send_message(
-                            admin_id,
-                            f"⚠️ <b>Rate limit на боте</b>\n\n"
-                            f"Переключение на резервный токен #{current_token_index + 1}",
-                            parse_mode="HTML"
-                        )
-                    except Exception:
-                        pass
+                notifier.broadcast(
+                    f"⚠️ <b>Rate limit на боте</b>\n\n"
+                    f"Переключение на резервный токен #{current_token_index + 1}"
+                )
                 
                 await asyncio.sleep(2)
             else:
@@ -170,8 +181,13 @@ async def main():
             break
     
     auth_task.cancel()
+    extra_sessions_task.cancel()
     await checker.stop()
-    await bot.session.close()
+    await outbox.stop()
+    await notifier.stop()
+    for pool_bot in bots:
+        await pool_bot.session.close()
+    await db.close()
     logger.info("Bot stopped")
 
 if __name__ == '__main__':
@@ -1,20 +1,116 @@
 import asyncio
 import logging
 import os
-from typing import List, Dict, Optional
-from telethon import TelegramClient
-from telethon.errors import UsernameInvalidError, UsernameNotOccupiedError, FloodWaitError
-from telethon.tl.functions.contacts import ResolveUsernameRequest
+import time
+from collections import deque, defaultdict
+from typing import List, Dict, Optional, NamedTuple, Tuple
+from telethon import TelegramClient, events
+from telethon.errors import (
+    UsernameInvalidError, UsernameNotOccupiedError, FloodWaitError, MultiError, RPCError
+)
+from telethon.tl.functions.contacts import ResolveUsernameRequest, AddContactRequest
+from telethon.tl.functions.users import GetUsersRequest
+from telethon.tl.functions.channels import GetChannelsRequest
+from telethon.tl.types import (
+    InputUser, InputChannel, PeerUser, PeerChannel, UpdateUserName, UpdateChannel
+)
 import config
+from rate_limiter import AdaptiveRateLimiter
+from status_cache import StatusCache
+from utils import is_valid_username
 
 logger = logging.getLogger(__name__)
 
-class UsernameChecker:
+class OwnerPeer(NamedTuple):
+    """Владелец занятого username. access_hash действителен только для сессии, которая его получила."""
+    peer_type: str  # 'user' или 'channel'
+    peer_id: int
+    access_hash: int
+    session_name: str
+
+
+class CheckerSession:
+    """Одна сессия Telethon из пула UsernameChecker"""
+    
     def __init__(self, api_id: int, api_hash: str, session_name: str):
         self.api_id = api_id
         self.api_hash = api_hash
         self.session_name = session_name
-        self.client = TelegramClient(session_name, api_id, api_hash)
+        self.client = self._create_client()
+        self.ready = False
+        self.flood_until = 0.0
+        self.rate_limiter = AdaptiveRateLimiter()
+    
+    def _create_client(self) -> TelegramClient:
+        # FloodWait не должен "засыпать" внутри Telethon: сессию паркует UsernameChecker
+        return TelegramClient(
+            self.session_name, self.api_id, self.api_hash, flood_sleep_threshold=0
+        )
+    
+    @property
+    def rate_setting_key(self) -> str:
+        return f"rate_state:{self.session_name}"
+    
+    def is_parked(self) -> bool:
+        """Сессия ждет окончания FloodWait"""
+        return time.monotonic() < self.flood_until
+    
+    def park(self, seconds: float):
+        if not self.is_parked():
+            self.rate_limiter.on_flood_wait(seconds)
+        self.flood_until = max(self.flood_until, time.monotonic() + seconds)
+    
+    def flood_wait_remaining(self) -> float:
+        return max(0.0, self.flood_until - time.monotonic())
+    
+    def is_available(self) -> bool:
+        return self.ready and self.client.is_connected() and not self.is_parked()
+    
+    async def reset(self):
+        self.ready = False
+        await self.client.disconnect()
+        
+        session_file = f"{self.session_name}.session"
+        session_journal = f"{self.session_name}.session-journal"
+        
+        for path in (session_file, session_journal):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to remove session file {path}: {e}")
+        
+        self.client = self._create_client()
+
+
+class UsernameChecker:
+    def __init__(self, api_id: int, api_hash: str, session_name: str,
+                 extra_session_names: Optional[List[str]] = None):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.session_name = session_name
+        # Первая сессия - основная, через нее проходит авторизация при старте бота
+        self.sessions = [CheckerSession(api_id, api_hash, session_name)]
+        for name in extra_session_names or []:
+            if name != session_name:
+                self.sessions.append(CheckerSession(api_id, api_hash, name))
+        self._next_session = 0
+        # Username, которые не успели проверить из-за FloodWait.
+        # Они идут первыми в следующий батч, статус в БД не меняется.
+        self.pending = deque()
+        self.cache = StatusCache()
+        # username -> Future с результатом проверки, которая уже идет
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Будит цикл мониторинга, когда push-обновление добавило кандидатов
+        self._wakeup = asyncio.Event()
+        self._db = None
+        self._scheduled = set()
+        # Свободные username, которые перепроверяет общий цикл _free_stage
+        self.free_usernames = set()
+        # Темп планировщика; обновляется из настроек бота на лету
+        self.batch_size = config.CHECK_BATCH_SIZE
+        self.check_interval = config.CHECK_INTERVAL
+        self.free_recheck_interval = config.FREE_RECHECK_MIN_INTERVAL
         self.is_running = False
         self._check_task = None
         self.auth_callbacks = {
@@ -22,18 +118,83 @@ class UsernameChecker:
             'code': None,
             'password': None
         }
+    
+    @property
+    def primary_session(self) -> CheckerSession:
+        return self.sessions[0]
+    
+    @property
+    def client(self) -> TelegramClient:
+        return self.primary_session.client
+    
+    def get_session(self, session_name: str) -> Optional[CheckerSession]:
+        return next((s for s in self.sessions if s.session_name == session_name), None)
+    
+    def get_available_sessions(self) -> List[CheckerSession]:
+        return [s for s in self.sessions if s.is_available()]
+    
+    def _pick_session(self) -> Optional[CheckerSession]:
+        """Выбирает следующую доступную сессию по кругу"""
+        available = self.get_available_sessions()
+        if not available:
+            return None
+        self._next_session = (self._next_session + 1) % len(available)
+        return available[self._next_session]
+    
+    def _earliest_flood_wait(self) -> float:
+        ready = [s for s in self.sessions if s.ready]
+        if not ready:
+            return 0.0
+        return min(s.flood_wait_remaining() for s in ready)
+    
+    async def _wait_for_session(self) -> bool:
+        """Ждет, пока хотя бы одна сессия выйдет из FloodWait.
         
-    async def start(self, phone_callback=None, code_callback=None, password_callback=None):
+        Ожидание идет короткими шагами, поэтому остальные задачи
+        (спам, уведомления, запись в БД) продолжают работать.
+        Возвращает False, если авторизованных сессий нет.
+        """
+        logged = False
+        while self.is_running and not self.get_available_sessions():
+            wait_time = self._earliest_flood_wait()
+            if wait_time <= 0:
+                return False
+            if not logged:
+                logger.info(
+                    f"All sessions are in FloodWait. Next session available in {wait_time:.0f} seconds "
+                    f"({wait_time/60:.1f} minutes), {len(self.pending)} usernames pending"
+                )
+                logged = True
+            await asyncio.sleep(min(wait_time, 1))
+        return self.is_running
+    
+    async def _idle(self, seconds: float):
+        """Пауза цикла мониторинга, которую прерывает push-обновление"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+    
+    def _take_pending(self) -> List[str]:
+        usernames = list(self.pending)
+        self.pending.clear()
+        return usernames
+    
+    async def start(self, phone_callback=None, code_callback=None, password_callback=None,
+                    session: Optional[CheckerSession] = None):
+        session = session or self.primary_session
         self.auth_callbacks['phone'] = phone_callback
         self.auth_callbacks['code'] = code_callback
         self.auth_callbacks['password'] = password_callback
         
-        await self.client.start(
+        await session.client.start(
             phone=phone_callback,
             code_callback=code_callback,
             password=password_callback
         )
-        logger.info("Telethon client started")
+        session.ready = True
+        logger.info(f"Telethon client started ({session.session_name})")
     
     def is_authorized(self) -> bool:
         return self.client.is_connected() and self.client.is_user_authorized()
@@ -42,192 +203,763 @@ class UsernameChecker:
         self.is_running = False
         if self._check_task:
             self._check_task.cancel()
-        await self.client.disconnect()
-        logger.info("Telethon client stopped")
-
-    async def reset_session(self):
-        await self.stop()
-
-        session_file = f"{self.session_name}.session"
-        session_journal = f"{self.session_name}.session-journal"
-
-        for path in (session_file, session_journal):
+        for session in self.sessions:
+            session.ready = False
+            await session.client.disconnect()
+        logger.info("Telethon clients stopped")
+    
+    async def reset_session(self, session: Optional[CheckerSession] = None):
+        session = session or self.primary_session
+        if session is self.primary_session:
+            # Останавливаем только мониторинг: остальные сессии пула остаются подключены
+            self.is_running = False
+            if self._check_task:
+                self._check_task.cancel()
+        await session.reset()
+    
+    async def load_rate_states(self, db):
+        """Восстанавливает выученную скорость сессий из БД"""
+        for session in self.sessions:
+            data = await db.get_setting(session.rate_setting_key)
+            if data:
+                session.rate_limiter.load(data)
+    
+    async def save_rate_states(self, db):
+        for session in self.sessions:
+            if session.ready:
+                await db.set_setting(session.rate_setting_key, session.rate_limiter.dump())
+    
+    def get_rate_stats(self) -> List[Dict]:
+        stats = []
+        for session in self.sessions:
+            state = session.rate_limiter.get_state()
+            state['session_name'] = session.session_name
+            state['ready'] = session.ready
+            state['flood_wait_remaining'] = session.flood_wait_remaining()
+            stats.append(state)
+        return stats
+    
+    async def _resolve(self, session: CheckerSession, username: str) -> str:
+        """Проверяет username через указанную сессию. FloodWaitError пробрасывается наружу."""
+        result = (await self._send_container(session, [username]))[username]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    @staticmethod
+    def _extract_owner(session: CheckerSession, resolved) -> Optional[OwnerPeer]:
+        if isinstance(resolved.peer, PeerUser):
+            peer_type, peer_id, entities = 'user', resolved.peer.user_id, resolved.users
+        elif isinstance(resolved.peer, PeerChannel):
+            peer_type, peer_id, entities = 'channel', resolved.peer.channel_id, resolved.chats
+        else:
+            return None
+        entity = next((e for e in entities if e.id == peer_id), None)
+        access_hash = getattr(entity, 'access_hash', None)
+        if access_hash is None:
+            return None
+        return OwnerPeer(peer_type, peer_id, access_hash, session.session_name)
+    
+    @staticmethod
+    def _owned_usernames(entity) -> set:
+        names = set()
+        if getattr(entity, 'username', None):
+            names.add(entity.username.lower())
+        for item in getattr(entity, 'usernames', None) or []:
+            if item.active:
+                names.add(item.username.lower())
+        return names
+    
+    async def _fetch_owner_entities(self, session: CheckerSession, peer_type: str,
+                                    owners: List[OwnerPeer]) -> list:
+        await session.rate_limiter.acquire()
+        if peer_type == 'user':
+            entities = await session.client(GetUsersRequest(
+                [InputUser(o.peer_id, o.access_hash) for o in owners]
+            ))
+        else:
+            result = await session.client(GetChannelsRequest(
+                [InputChannel(o.peer_id, o.access_hash) for o in owners]
+            ))
+            entities = result.chats
+        session.rate_limiter.on_success()
+        return entities
+    
+    async def probe_owners(self, owners: Dict[str, OwnerPeer]) -> Dict[str, str]:
+        """Перепроверяет занятые username одним запросом на пачку владельцев.
+        
+        Возвращает 'occupied' для username, которые владелец все еще держит.
+        Остальные (владелец сменил username, недоступен, FloodWait) в результат
+        не попадают и требуют полного resolve.
+        """
+        results = {}
+        groups = defaultdict(list)
+        for username, owner in owners.items():
+            groups[(owner.session_name, owner.peer_type)].append((username, owner))
+        
+        for (session_name, peer_type), items in groups.items():
+            session = self.get_session(session_name)
+            if session is None or not session.is_available():
+                continue
+            
+            for i in range(0, len(items), config.OWNER_PROBE_BATCH):
+                chunk = items[i:i + config.OWNER_PROBE_BATCH]
+                try:
+                    entities = await self._fetch_owner_entities(
+                        session, peer_type, [owner for _, owner in chunk]
+                    )
+                except FloodWaitError as e:
+                    logger.warning(f"FloodWait on owner probe ({session_name}): {e.seconds} seconds")
+                    session.park(e.seconds)
+                    break
+                except Exception as e:
+                    logger.error(f"Error probing {len(chunk)} owners on {session_name}: {e}")
+                    continue
+                
+                by_id = {entity.id: entity for entity in entities}
+                for username, owner in chunk:
+                    entity = by_id.get(owner.peer_id)
+                    if entity is not None and username in self._owned_usernames(entity):
+                        results[username] = 'occupied'
+                        self.cache.set(username, 'occupied')
+        
+        # Неподтвержденные username уйдут на полный resolve - старый 'occupied'
+        # из кэша не должен на него ответить
+        for username in owners:
+            if username not in results:
+                self.cache.invalidate(username)
+        
+        if results:
+            logger.info(f"Owner probe confirmed {len(results)}/{len(owners)} occupied usernames")
+        return results
+    
+    async def _on_owner_update(self, update):
+        """Push-обновление о смене username владельцем.
+        
+        Username, которые владелец больше не держит, сразу ставятся
+        в начало очереди на подтверждающий resolve.
+        """
+        if self._db is None:
+            return
+        
+        if isinstance(update, UpdateUserName):
+            owner_type, owner_id = 'user', update.user_id
+            current = {item.username.lower() for item in update.usernames if item.active}
+        elif isinstance(update, UpdateChannel):
+            # Обновление канала не содержит username - перепроверяем все его username
+            owner_type, owner_id, current = 'channel', update.channel_id, set()
+        else:
+            return
+        
+        try:
+            watched = await self._db.get_usernames_by_owner(owner_type, owner_id)
+        except Exception as e:
+            logger.error(f"Error handling owner update for {owner_type} {owner_id}: {e}")
+            return
+        
+        candidates = [username for username in watched if username not in current]
+        if not candidates:
+            return
+        
+        logger.info(f"Owner {owner_type} {owner_id} updated usernames, rechecking: {candidates}")
+        for username in candidates:
+            self.cache.invalidate(username)
+            self.pending.appendleft(username)
+        self._wakeup.set()
+    
+    def _register_push_handlers(self):
+        for session in self.sessions:
+            session.client.add_event_handler(
+                self._on_owner_update, events.Raw(types=[UpdateUserName, UpdateChannel])
+            )
+    
+    def _remove_push_handlers(self):
+        for session in self.sessions:
+            session.client.remove_event_handler(self._on_owner_update)
+    
+    async def sync_owner_contacts(self, db) -> int:
+        """Добавляет владельцев занятых username в контакты, чтобы получать их обновления"""
+        owners = await db.get_owners_without_contact(config.PUSH_CONTACTS_BATCH)
+        added = []
+        for username, owner in owners.items():
+            owner = OwnerPeer(*owner)
+            session = self.get_session(owner.session_name)
+            if session is None or not session.is_available():
+                continue
+            await session.rate_limiter.acquire()
             try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except OSError as e:
-                logger.warning(f"Failed to remove session file {path}: {e}")
-
-        self.client = TelegramClient(self.session_name, self.api_id, self.api_hash)
+                await session.client(AddContactRequest(
+                    id=InputUser(owner.peer_id, owner.access_hash),
+                    first_name=f"@{username}",
+                    last_name='',
+                    phone=''
+                ))
+                session.rate_limiter.on_success()
+            except FloodWaitError as e:
+                session.park(e.seconds)
+                break
+            except Exception as e:
+                logger.warning(f"Failed to add owner of @{username} to contacts: {e}")
+            # Отмечаем и при ошибке, чтобы не повторять заведомо неудачные запросы
+            added.append(username)
+        
+        if added:
+            await db.mark_owner_contacts(added)
+        return len(added)
+    
+    @staticmethod
+    def _status_from_error(error: Exception) -> Optional[str]:
+        if isinstance(error, UsernameNotOccupiedError):
+            return 'free'
+        if isinstance(error, UsernameInvalidError):
+            # Telegram не выдаст такой username - это не освобождение
+            return 'invalid'
+        return None
+    
+    async def _send_container(self, session: CheckerSession, usernames: List[str],
+                              owners: Optional[Dict[str, OwnerPeer]] = None) -> Dict[str, object]:
+        """Отправляет несколько ResolveUsername за один сетевой запрос (MTProto-контейнер).
+        
+        Возвращает для каждого username статус или исключение этого запроса
+        (например, FloodWaitError). Ошибки, относящиеся ко всему вызову,
+        пробрасываются наружу. Владельцы занятых username добавляются в owners.
+        """
+        for _ in usernames:
+            await session.rate_limiter.acquire()
+        
+        requests = [ResolveUsernameRequest(username) for username in usernames]
+        try:
+            if len(requests) == 1:
+                responses = [await session.client(requests[0])]
+            else:
+                responses = await session.client(requests, ordered=False)
+            errors = [None] * len(requests)
+        except MultiError as e:
+            responses, errors = e.results, e.exceptions
+        except FloodWaitError:
+            raise
+        except RPCError as e:
+            if len(requests) != 1:
+                raise
+            responses, errors = [None], [e]
+        
+        outcome = {}
+        for username, response, error in zip(usernames, responses, errors):
+            if error is None:
+                owner = self._extract_owner(session, response)
+                if owner is not None and owners is not None:
+                    owners[username] = owner
+                outcome[username] = 'occupied'
+            else:
+                outcome[username] = self._status_from_error(error) or error
+            if not isinstance(outcome[username], Exception):
+                session.rate_limiter.on_success()
+        return outcome
+    
+    async def _resolve_container_shared(self, session: CheckerSession, usernames: List[str],
+                                        owners: Optional[Dict[str, OwnerPeer]] = None) -> Dict[str, object]:
+        """Контейнерная проверка с объединением одновременных запросов одного username"""
+        loop = asyncio.get_running_loop()
+        shared = [username for username in usernames if username in self._inflight]
+        futures = {
+            username: loop.create_future()
+            for username in usernames if username not in self._inflight
+        }
+        self._inflight.update(futures)
+        
+        try:
+            outcome = await self._send_container(session, list(futures), owners) if futures else {}
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures.values():
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            for username in futures:
+                del self._inflight[username]
+        
+        for username, result in outcome.items():
+            if isinstance(result, Exception):
+                futures[username].set_exception(result)
+                futures[username].exception()
+            else:
+                self.cache.set(username, result)
+                futures[username].set_result(result)
+        
+        for username in shared:
+            try:
+                outcome[username] = await self._resolve_shared(session, username)
+            except Exception as e:
+                outcome[username] = e
+        return outcome
+    
+    async def _resolve_shared(self, session: CheckerSession, username: str) -> str:
+        """Проверяет username, объединяя одновременные запросы одного и того же имени.
+        
+        Если username уже проверяется (батч мониторинга, спам, ручная проверка),
+        второй запрос ждет результат первого вместо отправки еще одного RPC.
+        """
+        while True:
+            future = self._inflight.get(username)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Первый запрос отменили - проверяем сами
+            except FloodWaitError:
+                # FloodWait получила другая сессия - пробуем своей
+                if session.is_parked():
+                    raise
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[username] = future
+        try:
+            status = await self._resolve(session, username)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем исключение как полученное, даже если никто не ждал результат
+            future.exception()
+            raise
+        else:
+            self.cache.set(username, status)
+            future.set_result(status)
+            return status
+        finally:
+            del self._inflight[username]
     
     async def check_username(self, username: str) -> str:
         """Проверяет один username. Используется для единичных проверок."""
         username = username.lstrip('@').lower()
         
-        try:
-            await self.client(ResolveUsernameRequest(username))
-            return 'occupied'
-        except UsernameNotOccupiedError:
-            return 'free'
-        except UsernameInvalidError:
-            return 'free'
-        except FloodWaitError as e:
-            logger.warning(f"FloodWait: need to wait {e.seconds} seconds ({e.seconds/60:.1f} minutes)")
-            await asyncio.sleep(e.seconds)
-            return 'error'
-        except Exception as e:
-            logger.error(f"Error checking @{username}: {e}")
-            return 'error'
+        if not is_valid_username(username):
+            return 'invalid'
+        
+        cached = self.cache.get(username)
+        if cached is not None:
+            return cached
+        
+        while True:
+            session = self._pick_session()
+            if session is None:
+                # Все сессии в FloodWait - не ждем, вызывающий код сохранит старый статус
+                logger.warning(f"No available Telethon session to check @{username}")
+                return 'error'
+            
+            try:
+                return await self._resolve_shared(session, username)
+            except FloodWaitError as e:
+                session.park(e.seconds)
+                logger.warning(
+                    f"FloodWait on session {session.session_name}: need to wait {e.seconds} seconds "
+                    f"({e.seconds/60:.1f} minutes)"
+                )
+            except Exception as e:
+                logger.error(f"Error checking @{username}: {e}")
+                return 'error'
     
-    async def check_usernames_batch(self, usernames: List[str]) -> Dict[str, str]:
+    async def check_usernames_batch(self, usernames: List[str],
+                                    use_cache: bool = True) -> Tuple[Dict[str, str], Dict[str, OwnerPeer]]:
+        """Проверяет батч, распределяя username по всем доступным сессиям.
+        
+        Возвращает (статусы, владельцы занятых username, полученные при resolve).
+        Владельцы собираются отдельно для каждого вызова, поэтому параллельные
+        батчи не забирают чужие результаты.
+        
+        FloodWait останавливает только ту сессию, которая его получила,
+        ее username забирают остальные сессии. Если в FloodWait все сессии,
+        непроверенные username возвращаются в self.pending и не попадают
+        в результат, так что их статус в БД не меняется.
+        
+        use_cache=False - не отвечать из кэша (плановые проверки, у которых
+        интервал может быть короче TTL); результаты кэш все равно пополняют.
+        """
         results = {}
-        flood_wait_seconds = None
-        flood_wait_lock = asyncio.Lock()
-        stop_event = asyncio.Event()
+        owners = {}
+        queue = asyncio.Queue()
+        for username in usernames:
+            # Недопустимые username отсекаются локально, без запроса к API
+            if not is_valid_username(username.lstrip('@').lower()):
+                results[username] = 'invalid'
+                continue
+            cached = self.cache.get(username) if use_cache else None
+            if cached is not None:
+                results[username] = cached
+            else:
+                queue.put_nowait(username)
         
-        semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_CHECKS)
+        def on_flood_wait(session: CheckerSession, username: str, e: FloodWaitError):
+            if not session.is_parked():
+                # Логируем только один раз при первом FloodWait на сессии
+                logger.warning(
+                    f"FloodWait detected for @{username} on session {session.session_name}: "
+                    f"need to wait {e.seconds} seconds ({e.seconds/60:.1f} minutes). "
+                    f"Session parked, other sessions continue."
+                )
+            session.park(e.seconds)
+            queue.put_nowait(username)
         
-        async def check_with_semaphore(username: str):
-            nonlocal flood_wait_seconds
-            
-            # Проверяем, не произошел ли уже FloodWait
-            if stop_event.is_set():
-                return
-            
-            async with semaphore:
-                # Еще раз проверяем после получения семафора
-                if stop_event.is_set():
+        async def session_worker(session: CheckerSession):
+            while not queue.empty():
+                # Сессия получила FloodWait - оставляем username другим сессиям
+                if session.is_parked():
                     return
                 
+                # Несколько username за один сетевой запрос
+                chunk_size = min(max(1, config.RESOLVE_CONTAINER_SIZE), queue.qsize())
+                chunk = {}
+                for _ in range(chunk_size):
+                    username = queue.get_nowait()
+                    chunk[username.lstrip('@').lower()] = username
+                
                 try:
-                    username_clean = username.lstrip('@').lower()
-                    await self.client(ResolveUsernameRequest(username_clean))
-                    results[username] = 'occupied'
-                except UsernameNotOccupiedError:
-                    results[username] = 'free'
-                except UsernameInvalidError:
-                    results[username] = 'free'
+                    outcome = await self._resolve_container_shared(session, list(chunk), owners)
                 except FloodWaitError as e:
-                    # Устанавливаем FloodWait для всех задач
-                    async with flood_wait_lock:
-                        if flood_wait_seconds is None:
-                            flood_wait_seconds = e.seconds
-                            stop_event.set()  # Останавливаем все остальные задачи
-                            # Логируем только один раз при первом FloodWait
-                            logger.warning(
-                                f"FloodWait detected for @{username}: need to wait {e.seconds} seconds "
-                                f"({e.seconds/60:.1f} minutes). Stopping remaining batch checks."
-                            )
-                    results[username] = 'error'
+                    for username in chunk.values():
+                        on_flood_wait(session, username, e)
+                    continue
                 except Exception as e:
-                    logger.error(f"Error checking @{username}: {e}")
-                    results[username] = 'error'
-                finally:
-                    # Задержка между проверками для снижения нагрузки на API
-                    await asyncio.sleep(0.2)  # Увеличено с 0.1 до 0.2 секунды
+                    logger.error(f"Error checking {len(chunk)} usernames: {e}")
+                    for username in chunk.values():
+                        results[username] = 'error'
+                    continue
+                
+                for username_clean, result in outcome.items():
+                    username = chunk[username_clean]
+                    if isinstance(result, FloodWaitError):
+                        on_flood_wait(session, username, result)
+                    elif isinstance(result, Exception):
+                        logger.error(f"Error checking @{username}: {result}")
+                        results[username] = 'error'
+                    else:
+                        results[username] = result
         
-        # Запускаем все задачи
-        tasks = [check_with_semaphore(username) for username in usernames]
-        await asyncio.gather(*tasks, return_exceptions=True)
+        # На каждую доступную сессию - MAX_CONCURRENT_CHECKS параллельных воркеров,
+        # темп запросов задает rate limiter сессии.
+        # Повторяем, пока есть username, возвращенные в очередь после FloodWait
+        while not queue.empty():
+            sessions = self.get_available_sessions()
+            if not sessions:
+                break
+            tasks = [
+                session_worker(session)
+                for session in sessions
+                for _ in range(config.MAX_CONCURRENT_CHECKS)
+            ]
+            await asyncio.gather(*tasks, return_exceptions=True)
         
-        # Если произошел FloodWait, ждем нужное время
-        if flood_wait_seconds is not None:
-            checked_count = len(results)
-            skipped_count = len(usernames) - checked_count
+        # Все сессии в FloodWait - возвращаем оставшиеся username в очередь ожидания
+        if not queue.empty():
+            skipped = []
+            while not queue.empty():
+                skipped.append(queue.get_nowait())
+            self.pending.extend(skipped)
             logger.info(
-                f"FloodWait occurred. Checked {checked_count}/{len(usernames)} usernames. "
-                f"Waiting {flood_wait_seconds} seconds ({flood_wait_seconds/60:.1f} minutes) before continuing..."
+                f"All sessions are in FloodWait. Checked {len(results)}/{len(usernames)} usernames, "
+                f"{len(skipped)} rescheduled"
             )
-            
-            # Ждем с проверкой is_running, чтобы можно было остановить мониторинг
-            wait_time = flood_wait_seconds
-            while wait_time > 0 and self.is_running:
-                sleep_time = min(60, wait_time)  # Проверяем каждую минуту
-                await asyncio.sleep(sleep_time)
-                wait_time -= sleep_time
-                if wait_time > 0 and self.is_running:
-                    logger.info(f"Still waiting... {wait_time:.0f} seconds remaining")
-            
-            # Для username, которые не были проверены из-за FloodWait, помечаем как 'error'
-            for username in usernames:
-                if username not in results:
-                    results[username] = 'error'
-            
-            logger.info(f"FloodWait wait completed. Continuing monitoring...")
         
-        return results
+        resolved_owners = {}
+        for username in results:
+            owner = owners.get(username.lstrip('@').lower())
+            if owner is not None:
+                resolved_owners[username] = owner
+        return results, resolved_owners
+    
+    async def _sync_free_usernames(self, db, notify_queue: asyncio.Queue):
+        """Сверяет набор свободных username с БД (например, после ручной проверки)"""
+        free_usernames = set(await db.get_free_usernames())
+        # Удаленные из базы или занятые вне мониторинга username больше не проверяем
+        self.free_usernames -= self.free_usernames - free_usernames - self._scheduled
+        new_usernames = free_usernames - self.free_usernames
+        if new_usernames:
+            logger.info(f"Found {len(new_usernames)} free usernames. Starting notifications for them...")
+            self.free_usernames.update(new_usernames)
+            for username in new_usernames:
+                await notify_queue.put((username, True))
     
     async def start_monitoring(self, db, notification_callback, spam_handler=None):
+        """Запускает конвейер мониторинга.
+        
+        Стадии связаны ограниченными очередями и работают одновременно:
+        schedule (выбор username, чья очередь подошла) → resolve (запросы к API)
+        → persist (запись в БД) → notify (уведомления). Медленная запись
+        или отправка уведомления не останавливает запросы к API, а переполненная
+        очередь притормаживает предыдущую стадию.
+        
+        notification_callback(username) вызывается, когда username стал свободным,
+        spam_handler(username) - при каждой повторной проверке, подтвердившей,
+        что он все еще свободен.
+        """
         self.is_running = True
         logger.info("Monitoring started - entering main loop")
+        await self.load_rate_states(db)
+        
+        self.batch_size = await db.get_setting_as('batch_size', int, config.CHECK_BATCH_SIZE)
+        self.check_interval = await db.get_setting_as('check_interval', float, config.CHECK_INTERVAL)
+        self.free_recheck_interval = max(
+            config.FREE_RECHECK_MIN_INTERVAL, await db.get_setting_as('spam_delay', float, 0.0)
+        )
+        db.subscribe_settings(self._on_setting_changed)
+        
+        self._db = db
+        if config.PUSH_DETECTION_ENABLED:
+            self._register_push_handlers()
+        
+        # Username, которые уже в конвейере и еще не записаны в БД
+        self._scheduled = set()
+        self.free_usernames = set()
+        resolve_queue = asyncio.Queue(maxsize=config.PIPELINE_RESOLVE_QUEUE_SIZE)
+        persist_queue = asyncio.Queue(maxsize=config.PIPELINE_PERSIST_QUEUE_SIZE)
+        notify_queue = asyncio.Queue(maxsize=config.PIPELINE_NOTIFY_QUEUE_SIZE)
+        
+        schedule_task = asyncio.create_task(self._schedule_stage(db, resolve_queue))
+        stages = [
+            schedule_task,
+            *(
+                asyncio.create_task(self._resolve_stage(db, resolve_queue, persist_queue))
+                for _ in range(config.PIPELINE_RESOLVE_WORKERS)
+            ),
+            asyncio.create_task(self._free_stage(db, persist_queue, notify_queue)),
+            asyncio.create_task(self._persist_stage(db, persist_queue, notify_queue)),
+            asyncio.create_task(self._notify_stage(notify_queue, notification_callback, spam_handler)),
+        ]
         
-        # Проверяем свободные username при старте
-        if spam_handler:
-            free_usernames = await db.get_free_usernames()
-            if free_usernames:
-                logger.info(f"Found {len(free_usernames)} free usernames at startup. Starting spam for them...")
-                for username in free_usernames:
-                    try:
-                        await spam_handler(username)
-                    except Exception as e:
-                        logger.error(f"Error starting spam for @{username}: {e}")
+        try:
+            # Планировщик завершается, когда мониторинг остановлен; остальные стадии бесконечны
+            await schedule_task
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            db.unsubscribe_settings(self._on_setting_changed)
+            if config.PUSH_DETECTION_ENABLED:
+                self._remove_push_handlers()
+            self._db = None
+        
+        logger.info("Monitoring stopped")
+    
+    def _on_setting_changed(self, key: str, value: str):
+        """Применяет изменения темпа из настроек бота к работающему мониторингу"""
+        try:
+            if key == 'batch_size':
+                self.batch_size = int(value)
+            elif key == 'check_interval':
+                self.check_interval = float(value)
+            elif key == 'spam_delay':
+                self.free_recheck_interval = max(config.FREE_RECHECK_MIN_INTERVAL, float(value))
+            else:
+                return
+        except ValueError:
+            logger.warning(f"Ignoring invalid setting {key}={value!r}")
+            return
+        logger.info(f"Monitoring setting updated: {key}={value}")
+        self._wakeup.set()
+    
+    async def _schedule_stage(self, db, resolve_queue: asyncio.Queue):
+        """Выбирает username, чья очередь подошла, и отдает их батчами на проверку"""
+        last_contacts_sync = 0.0
         
         while self.is_running:
             try:
-                usernames = await db.get_usernames_for_check()
+                # FloodWait - это дедлайн сессии, а не блокирующий sleep внутри батча
+                if not await self._wait_for_session():
+                    if self.is_running:
+                        logger.warning("No authorized Telethon sessions available, waiting...")
+                        await asyncio.sleep(10)
+                    continue
+                
+                if (config.PUSH_DETECTION_ENABLED and config.PUSH_ADD_CONTACTS
+                        and time.monotonic() - last_contacts_sync >= config.CYCLE_DELAY):
+                    await self.sync_owner_contacts(db)
+                    last_contacts_sync = time.monotonic()
+                
+                # Сначала отложенные после FloodWait username, затем те, чья очередь подошла
+                due = await db.get_due_usernames(self.batch_size + len(self._scheduled))
+                batch = list(dict.fromkeys(
+                    self._take_pending() + [u for u in due if u not in self._scheduled]
+                ))[:self.batch_size]
                 
-                if not usernames:
-                    logger.info("No usernames to check, waiting...")
-                    await asyncio.sleep(10)
+                # Занятые username с известным владельцем почти не тратят запросов:
+                # их добавляем сверх batch_size, до OWNER_PROBE_BATCH штук
+                if config.OWNER_PROBE_ENABLED:
+                    owned = await db.get_due_owned_usernames(
+                        config.OWNER_PROBE_BATCH + len(self._scheduled) + len(batch)
+                    )
+                    taken = set(batch)
+                    batch += [
+                        u for u in owned if u not in self._scheduled and u not in taken
+                    ][:config.OWNER_PROBE_BATCH]
+                
+                if not batch:
+                    next_check_at = await db.get_next_check_time()
+                    if next_check_at is None:
+                        logger.info("No usernames to check, waiting...")
+                        await self._idle(10)
+                    else:
+                        await self._idle(min(max(next_check_at - time.time(), 0.5), config.CYCLE_DELAY))
                     continue
                 
-                logger.info(f"Starting check cycle for {len(usernames)} usernames")
+                self._scheduled.update(batch)
+                await resolve_queue.put(batch)
                 
-                for i in range(0, len(usernames), config.CHECK_BATCH_SIZE):
-                    if not self.is_running:
-                        break
-                    
-                    batch = usernames[i:i + config.CHECK_BATCH_SIZE]
-                    results = await self.check_usernames_batch(batch)
-                    
+                if self.check_interval > 0:
+                    await self._idle(self.check_interval)
+            
+            except Exception as e:
+                logger.error(f"Error in schedule stage: {e}", exc_info=True)
+                await asyncio.sleep(5)
+    
+    async def _resolve_stage(self, db, resolve_queue: asyncio.Queue, persist_queue: asyncio.Queue):
+        """Проверяет батчи через API и передает результаты на запись"""
+        while True:
+            batch = await resolve_queue.get()
+            try:
+                results = {}
+                if config.OWNER_PROBE_ENABLED:
+                    owners = await db.get_owners(batch)
+                    if owners:
+                        results = await self.probe_owners(
+                            {username: OwnerPeer(*owner) for username, owner in owners.items()}
+                        )
+                
+                # Полный resolve - не больше batch_size username; неподтвержденные
+                # проверкой владельцев сверх этого идут первыми в следующий батч
+                unresolved = [username for username in batch if username not in results]
+                self.pending.extend(unresolved[self.batch_size:])
+                
+                # Плановая проверка идет мимо кэша: интервал приоритетных username короче TTL
+                checked, resolved_owners = await self.check_usernames_batch(
+                    unresolved[:self.batch_size],
+                    use_cache=False
+                )
+                results.update(checked)
+                
+                # Непроверенные username уже лежат в self.pending и снова пройдут планировщик
+                self._scheduled.difference_update(u for u in batch if u not in results)
+                
+                for username, status in results.items():
+                    await persist_queue.put((username, status, resolved_owners.get(username)))
+                
+                logger.info(f"Checked batch of {len(results)}/{len(batch)} usernames")
+                await self.save_rate_states(db)
+            
+            except Exception as e:
+                self._scheduled.difference_update(batch)
+                logger.error(f"Error in resolve stage: {e}", exc_info=True)
+            finally:
+                resolve_queue.task_done()
+    
+    async def _free_stage(self, db, persist_queue: asyncio.Queue, notify_queue: asyncio.Queue):
+        """Перепроверяет все свободные username одной пачкой раз в free_recheck_interval.
+        
+        Один общий цикл вместо отдельной задачи на каждый свободный username,
+        поэтому расход запросов не растет с каждым освободившимся username.
+        Результаты идут в persist так же, как из основного цикла.
+        """
+        last_sync = 0.0
+        while True:
+            try:
+                # Сверяемся с БД при старте и каждые CYCLE_DELAY секунд
+                if time.monotonic() - last_sync >= config.CYCLE_DELAY:
+                    await self._sync_free_usernames(db, notify_queue)
+                    last_sync = time.monotonic()
+                
+                await asyncio.sleep(self.free_recheck_interval)
+                
+                batch = [u for u in self.free_usernames if u not in self._scheduled]
+                if not batch or not self.get_available_sessions():
+                    continue
+                
+                self._scheduled.update(batch)
+                results = {}
+                try:
+                    results, resolved_owners = await self.check_usernames_batch(batch)
                     for username, status in results.items():
-                        old_status = await db.update_username_status(username, status)
-                        
-                        # Отправляем уведомление каждый раз, когда username свободен
-                        if status == 'free':
+                        await persist_queue.put((username, status, resolved_owners.get(username)))
+                finally:
+                    self._scheduled.difference_update(u for u in batch if u not in results)
+            
+            except Exception as e:
+                logger.error(f"Error in free usernames stage: {e}", exc_info=True)
+                await asyncio.sleep(5)
+    
+    async def _persist_stage(self, db, persist_queue: asyncio.Queue, notify_queue: asyncio.Queue):
+        """Записывает результаты в БД пачками и решает, о чем уведомлять"""
+        while True:
+            batch = [await persist_queue.get()]
+            
+            # Write-behind: копим результаты, пока пачка не заполнится или не выйдет время
+            deadline = time.monotonic() + config.PERSIST_FLUSH_INTERVAL
+            while len(batch) < config.PERSIST_BATCH_SIZE:
+                try:
+                    batch.append(persist_queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(persist_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                old_statuses = await db.update_statuses(batch)
+                
+                for username, status, _ in batch:
+                    old_status = old_statuses.get(username)
+                    
+                    # Отправляем уведомление каждый раз, когда username свободен
+                    if status == 'free':
+                        is_new = username not in self.free_usernames
+                        if is_new:
                             logger.info(f"USERNAME FREE: @{username}")
-                            await notification_callback(username)
-                        
-                        # Прекращаем уведомления, если username снова занят
-                        elif old_status == 'free' and status == 'occupied':
-                            logger.info(f"USERNAME RE-OCCUPIED: @{username} - notifications stopped")
-                            await db.reset_notified(username)
+                            self.free_usernames.add(username)
+                        await notify_queue.put((username, is_new))
+                        continue
                     
-                    logger.info(f"Checked batch {i//config.CHECK_BATCH_SIZE + 1}/{(len(usernames)-1)//config.CHECK_BATCH_SIZE + 1}")
-                    await asyncio.sleep(config.CHECK_INTERVAL)
-                
-                # Проверяем свободные username после каждого цикла
-                if spam_handler:
-                    free_usernames = await db.get_free_usernames()
-                    if free_usernames:
-                        logger.info(f"Found {len(free_usernames)} free usernames. Starting spam for them...")
-                        for username in free_usernames:
-                            try:
-                                await spam_handler(username)
-                            except Exception as e:
-                                logger.error(f"Error starting spam for @{username}: {e}")
-                
-                logger.info(f"Cycle completed. Waiting {config.CYCLE_DELAY} seconds before next cycle...")
-                await asyncio.sleep(config.CYCLE_DELAY)
-                
+                    # Ошибка проверки не меняет статус - продолжаем перепроверять
+                    if status != 'error':
+                        self.free_usernames.discard(username)
+                    
+                    # Напоминания прекращаются сами; флаг notified сброшен в update_statuses
+                    if old_status == 'free' and status == 'occupied':
+                        logger.info(f"USERNAME RE-OCCUPIED: @{username} - notifications stopped")
+            
             except Exception as e:
-                logger.error(f"Error in monitoring loop: {e}", exc_info=True)
-                await asyncio.sleep(5)
-        
-        logger.info("Monitoring stopped")
+                logger.error(f"Error saving {len(batch)} statuses: {e}", exc_info=True)
+            finally:
+                for username, _, _ in batch:
+                    self._scheduled.discard(username)
+                    persist_queue.task_done()
+    
+    async def _notify_stage(self, notify_queue: asyncio.Queue, notification_callback, spam_handler=None):
+        while True:
+            username, is_new = await notify_queue.get()
+            try:
+                if is_new:
+                    await notification_callback(username)
+                elif spam_handler:
+                    await spam_handler(username)
+            except Exception as e:
+                logger.error(f"Error in notification for @{username}: {e}", exc_info=True)
+            finally:
+                notify_queue.task_done()
     
     def stop_monitoring(self):
         self.is_running = False
+        self._wakeup.set()
         if self._check_task and not self._check_task.done():
             self._check_task.cancel()
             logger.info("Monitoring task cancelled")
@@ -3,7 +3,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Поддержка нескольких токенов для переключения при rate limit
+# Несколько токенов: уведомления рассылаются через все боты сразу (notifier.py),
+# обновления принимает первый, остальные подменяют его при rate limit
 bot_tokens_str = os.getenv('BOT_TOKENS', os.getenv('BOT_TOKEN', ''))
 BOT_TOKENS = [token.strip() for token in bot_tokens_str.split(',') if token.strip()]
 BOT_TOKEN = BOT_TOKENS[0] if BOT_TOKENS else None
@@ -15,18 +16,151 @@ ADMIN_IDS = [int(id.strip()) for id in admin_ids_str.split(',') if id.strip()]
 ADMIN_ID = ADMIN_IDS[0] if ADMIN_IDS else 0
 
 DB_PATH = 'usernames.db'
+
+# SQLite: долгоживущие пулы соединений на запись и на чтение (WAL)
+DB_READ_CONNECTIONS = 3
+DB_CACHE_SIZE_KB = 64 * 1024
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHED_STATEMENTS = 256
+DB_BUSY_TIMEOUT_MS = 5000
+# Запись без общего lock: соединения записи, пауза между повторами BEGIN IMMEDIATE
+# (сек, удваивается до максимума) и размер одной транзакции длинных операций
+DB_WRITE_CONNECTIONS = 2
+DB_WRITE_RETRY_MIN_DELAY = 0.005
+DB_WRITE_RETRY_MAX_DELAY = 0.1
+DB_WRITE_CHUNK_SIZE = 5000
+# Сколько фоновая запись (импорт, очистка) ждет паузы в обычных записях,
+# прежде чем выполнить свою транзакцию (сек)
+DB_BACKGROUND_MAX_WAIT = 0.5
+# Максимум параметров в одном запросе WHERE ... IN (...)
+DB_IN_CHUNK_SIZE = 500
+
+# Размер страницы при постраничном обходе таблицы usernames
+KEYSET_PAGE_SIZE = 5000
+
+# Импорт списков username: строк, читаемых из файла за раз, и период обновления прогресса (сек)
+IMPORT_BATCH_SIZE = 50000
+IMPORT_PROGRESS_INTERVAL = 3
+
+# Экспорт: строк на одно чтение курсора, сжатие gzip и максимальный размер
+# одной части в байтах (лимит Bot API на отправку файла - 50 МБ)
+EXPORT_FETCH_SIZE = 10000
+EXPORT_GZIP = False
+EXPORT_PART_SIZE = 45 * 1024 * 1024
 SESSION_NAME = 'checker_session'
 
+# Дополнительные сессии Telethon для распределения проверок (через запятую).
+# Каждый аккаунт имеет свой лимит FloodWait, поэтому скорость растет с числом сессий.
+# Авторизовать дополнительные сессии можно через бота: "⚙ Настройки" → "👥 Сессии"
+session_names_str = os.getenv('SESSION_NAMES', '')
+EXTRA_SESSION_NAMES = [
+    name.strip() for name in session_names_str.split(',')
+    if name.strip() and name.strip() != SESSION_NAME
+]
+
 # Оптимальные настройки для избежания FloodWait
 # Рекомендуемые значения для стабильной работы:
 # - MAX_CONCURRENT_CHECKS: 3-5 (безопасно), 5-10 (умеренно), 10-20 (агрессивно)
-# - CHECK_INTERVAL: 2-5 секунд между батчами
 # - CHECK_BATCH_SIZE: 20-50 username в батче
-# - CYCLE_DELAY: 10-30 секунд между полными циклами
+# - CYCLE_DELAY: 10-30 секунд между сверками списка свободных username с БД
 
+# CHECK_BATCH_SIZE и CHECK_INTERVAL - значения по умолчанию для новой базы,
+# дальше они меняются в настройках бота и применяются без перезапуска
 CHECK_BATCH_SIZE = 20  # Уменьшено для более безопасной работы
-CHECK_INTERVAL = 5  # Увеличено до 5 секунд между батчами для снижения нагрузки
-MAX_CONCURRENT_CHECKS = 3  # Уменьшено до 3 для максимальной безопасности от FloodWait
-CYCLE_DELAY = 20  # Увеличено до 20 секунд между полными циклами
+CHECK_INTERVAL = 0  # Пауза между батчами планировщика (сек), скорость задает rate limiter
+MAX_CONCURRENT_CHECKS = 3  # Максимум одновременных запросов на одну сессию
+CYCLE_DELAY = 20  # Пересканирование свободных username и максимальная пауза планировщика
+
+# Свободные username не идут через планировщик: их перепроверяет один общий цикл,
+# всей пачкой раз в spam_delay секунд, но не чаще FREE_RECHECK_MIN_INTERVAL.
+# Каждая проверка, подтвердившая, что username свободен, дает напоминание админам.
+FREE_RECHECK_MIN_INTERVAL = 3.0
+
+# Конвейер мониторинга: schedule → resolve → persist → notify.
+# Размеры очередей между стадиями ограничены, чтобы медленная стадия
+# притормаживала предыдущую, а не копила память.
+PIPELINE_RESOLVE_WORKERS = 2  # Батчей, проверяемых одновременно
+PIPELINE_RESOLVE_QUEUE_SIZE = 2  # Батчей в очереди на проверку
+PIPELINE_PERSIST_QUEUE_SIZE = 1000  # Результатов в очереди на запись в БД
+PIPELINE_NOTIFY_QUEUE_SIZE = 1000  # Уведомлений в очереди на отправку
+
+# Результаты пишутся в БД пачками: до PERSIST_BATCH_SIZE штук или раз в PERSIST_FLUSH_INTERVAL секунд
+PERSIST_BATCH_SIZE = 200
+PERSIST_FLUSH_INTERVAL = 0.2
+
+# Минимальная длина username, который можно занять в Telegram.
+# Более короткие, а также не подходящие по формату username получают
+# статус 'invalid' и не отправляются в API.
+USERNAME_MIN_LENGTH = 5
+USERNAME_MAX_LENGTH = 32
+
+# Планировщик проверок: у каждого username свой интервал проверки.
+# Базовый интервал (секунды) задается приоритетом:
+# 0 - обычный, 1 - повышенный, 2 - высокий, 3 - критический
+PRIORITY_INTERVALS = {0: 600, 1: 120, 2: 30, 3: 5}
+DEFAULT_PRIORITY = 0
+MIN_CHECK_INTERVAL = 3
+MAX_CHECK_INTERVAL = 6 * 3600
+# Давно занятые username проверяются реже: +1 базовый интервал за каждые
+# OCCUPIED_AGE_STEP секунд занятости, но не более OCCUPIED_AGE_MAX_FACTOR раз
+OCCUPIED_AGE_STEP = 7 * 86400
+OCCUPIED_AGE_MAX_FACTOR = 4
+# Username, часто менявшие статус за этот период (по таблице logs), проверяются чаще
+STATUS_CHANGE_WINDOW = 30 * 86400
+CHECK_JITTER = 0.1
+
+# Проверка владельцев: для занятых username сохраняется владелец (id + access_hash),
+# и до OWNER_PROBE_BATCH username перепроверяются одним запросом users.GetUsers /
+# channels.GetChannels. Полный resolve нужен только если владелец сменил username.
+# Такие username добавляются в батч сверх CHECK_BATCH_SIZE
+OWNER_PROBE_ENABLED = True
+OWNER_PROBE_BATCH = 100
+
+# Push-обнаружение: Telegram присылает обновления об изменении username владельцев
+# (UpdateUserName / UpdateChannel). Старый username сразу уходит на проверку,
+# не дожидаясь своей очереди в планировщике.
+PUSH_DETECTION_ENABLED = True
+# Добавлять владельцев в контакты, чтобы получать их обновления.
+# Лимит контактов на аккаунт ограничен, поэтому по умолчанию выключено.
+PUSH_ADD_CONTACTS = False
+PUSH_CONTACTS_BATCH = 50  # Контактов за один проход синхронизации
+
+# Сколько ResolveUsername отправлять одним MTProto-контейнером (1 - по одному).
+# Каждый запрос в контейнере получает свой результат или ошибку.
+RESOLVE_CONTAINER_SIZE = 10
+
+# Кэш результатов проверки (секунды жизни для каждого статуса, 0 - не кэшировать).
+# Повторный запрос того же username в пределах TTL отвечается из кэша без API.
+STATUS_CACHE_TTL = {'occupied': 30, 'free': 2, 'invalid': 3600, 'error': 0}
+STATUS_CACHE_SIZE = 100000
+
+# Адаптивный контроль скорости (token bucket на каждую сессию).
+# Скорость растет на RATE_INCREASE_STEP после каждого успешного запроса
+# и умножается на RATE_BACKOFF_FACTOR при FloodWait. Выученная скорость
+# сохраняется в БД и восстанавливается после перезапуска.
+RATE_INITIAL = 3.0  # Запросов в секунду для новой сессии
+RATE_MIN = 0.2
+RATE_MAX = 30.0
+RATE_INCREASE_STEP = 0.02
+RATE_BACKOFF_FACTOR = 0.5
+RATE_BURST = 5  # Размер корзины токенов
+
+# Исходящие уведомления бота идут через одну очередь (notifier.py).
+# Bot API допускает ~30 сообщений/с на бота и ~1 сообщение/с в один чат.
+NOTIFY_GLOBAL_RATE = 30.0  # Сообщений в секунду на бота
+NOTIFY_CHAT_INTERVAL = 1.0  # Минимальная пауза между сообщениями в один чат (секунды)
+NOTIFY_CONCURRENCY = 10  # Одновременных запросов send_message
+NOTIFY_SEND_TIMEOUT = 10  # Таймаут отправки одному получателю (секунды)
+# Если к моменту отправки освободилось несколько username, они уходят одним
+# сообщением-дайджестом (не больше NOTIFY_DIGEST_LIMIT username в сообщении)
+NOTIFY_DIGEST_LIMIT = 50
+
+# Уведомления об освободившихся username сначала пишутся в таблицу outbox
+# (в одной транзакции со сменой статуса), поэтому переживают перезапуск бота.
+# Неудачная отправка повторяется через OUTBOX_RETRY_MIN_DELAY секунд,
+# пауза удваивается с каждой попыткой до OUTBOX_RETRY_MAX_DELAY.
+OUTBOX_POLL_INTERVAL = 5
+OUTBOX_RETRY_MIN_DELAY = 5
+OUTBOX_RETRY_MAX_DELAY = 600
 
 LOG_FILE = 'logs/bot.log'
@@ -1,16 +1,156 @@
 import aiosqlite
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional
 import config
+from scheduler import compute_check_interval
+from utils import is_valid_username
 
 class Database:
-    def __init__(self, db_path: str = config.DB_PATH):
+    def __init__(self, db_path: str = config.DB_PATH,
+                 read_connections: int = config.DB_READ_CONNECTIONS,
+                 write_connections: int = config.DB_WRITE_CONNECTIONS):
         self.db_path = db_path
-        self._lock = asyncio.Lock()
+        self.read_connections = read_connections
+        self.write_connections = write_connections
+        self._writers: Optional[asyncio.Queue] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._connections: List[aiosqlite.Connection] = []
+        # Обычные записи (мониторинг, интерфейс) в процессе; фоновые ждут, пока их нет
+        self._foreground_writes = 0
+        self._foreground_idle = asyncio.Event()
+        self._foreground_idle.set()
+        # Закрывается, когда фоновая запись ждала дольше DB_BACKGROUND_MAX_WAIT:
+        # новые обычные записи пропускают ее транзакцию вперед
+        self._foreground_gate = asyncio.Event()
+        self._foreground_gate.set()
+        # Таблица settings целиком в памяти: читается один раз, обновляется в set_setting
+        self._settings: Optional[Dict[str, str]] = None
+        self._setting_listeners: List[Callable[[str, str], None]] = []
+    
+    async def _connect(self, busy_timeout_ms: int = config.DB_BUSY_TIMEOUT_MS, **kwargs) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(
+            self.db_path, cached_statements=config.DB_CACHED_STATEMENTS, **kwargs
+        )
+        await db.execute('PRAGMA journal_mode=WAL')
+        await db.execute('PRAGMA synchronous=NORMAL')
+        await db.execute(f'PRAGMA cache_size=-{config.DB_CACHE_SIZE_KB}')
+        await db.execute(f'PRAGMA mmap_size={config.DB_MMAP_SIZE}')
+        await db.execute('PRAGMA temp_store=MEMORY')
+        await db.execute(f'PRAGMA busy_timeout={busy_timeout_ms}')
+        return db
+    
+    async def connect(self):
+        """Открывает пулы соединений на запись и на чтение"""
+        if self._writers is not None:
+            return
+        self._writers = asyncio.Queue()
+        self._readers = asyncio.Queue()
+        # Соединения записи открываются первыми, чтобы включить WAL до подключения читателей.
+        # Они работают в autocommit, транзакции открываются явно в _begin_immediate
+        for _ in range(max(1, self.write_connections)):
+            writer = await self._connect(busy_timeout_ms=0, isolation_level=None)
+            self._connections.append(writer)
+            self._writers.put_nowait(writer)
+        for _ in range(max(1, self.read_connections)):
+            reader = await self._connect()
+            self._connections.append(reader)
+            self._readers.put_nowait(reader)
+    
+    async def close(self):
+        for connection in self._connections:
+            await connection.close()
+        self._connections = []
+        self._writers = None
+        self._readers = None
+    
+    @asynccontextmanager
+    async def _read(self):
+        """Соединение из пула читателей; в WAL чтение не ждет записи"""
+        if self._readers is None:
+            await self.connect()
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+    
+    @staticmethod
+    async def _begin_immediate(db: aiosqlite.Connection):
+        """Берет блокировку записи SQLite, повторяя BEGIN IMMEDIATE до DB_BUSY_TIMEOUT_MS.
+        
+        У соединений записи busy_timeout=0: ожидание внутри SQLite занимает
+        поток соединения и в тестах останавливало транзакцию, которая держит
+        блокировку, поэтому ждем между попытками в event loop.
+        """
+        deadline = time.monotonic() + config.DB_BUSY_TIMEOUT_MS / 1000
+        delay = config.DB_WRITE_RETRY_MIN_DELAY
+        while True:
+            try:
+                await db.execute('BEGIN IMMEDIATE')
+                return
+            except aiosqlite.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() + delay > deadline:
+                    raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, config.DB_WRITE_RETRY_MAX_DELAY)
+    
+    @asynccontextmanager
+    async def _write(self, background: bool = False):
+        """Транзакция BEGIN IMMEDIATE на соединении из пула записи.
+        
+        Очередность записей определяет сама SQLite, а не общий lock. Фоновая
+        запись (background=True: импорт, очистка базы) начинается, только когда
+        нет обычных записей, поэтому длинные операции, разбитые на короткие
+        транзакции, пропускают вперед запись статусов и действия из интерфейса.
+        Ожидание ограничено DB_BACKGROUND_MAX_WAIT: если обычные записи идут
+        без перерыва, новые из них ждут, пока фоновая транзакция не начнется,
+        так что импорт продвигается хотя бы на одну транзакцию за это время.
+        """
+        if self._writers is None:
+            await self.connect()
+        gated = False
+        if background:
+            try:
+                await asyncio.wait_for(self._foreground_idle.wait(), config.DB_BACKGROUND_MAX_WAIT)
+            except asyncio.TimeoutError:
+                self._foreground_gate.clear()
+                gated = True
+        else:
+            await self._foreground_gate.wait()
+            self._foreground_writes += 1
+            self._foreground_idle.clear()
+        try:
+            if gated:
+                # Дожидаемся уже начатых обычных записей, новые не начнутся
+                await self._foreground_idle.wait()
+            db = await self._writers.get()
+            try:
+                try:
+                    await self._begin_immediate(db)
+                finally:
+                    if gated:
+                        self._foreground_gate.set()
+                try:
+                    yield db
+                    await db.commit()
+                except BaseException:
+                    await db.rollback()
+                    raise
+            finally:
+                self._writers.put_nowait(db)
+        finally:
+            if gated:
+                self._foreground_gate.set()
+            if not background:
+                self._foreground_writes -= 1
+                if not self._foreground_writes:
+                    self._foreground_idle.set()
     
     async def init_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS usernames (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,10 +158,87 @@ class Database:
                     status TEXT DEFAULT 'unknown',
                     last_check TIMESTAMP,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    notified INTEGER DEFAULT 0
+                    notified INTEGER DEFAULT 0,
+                    priority INTEGER DEFAULT 0,
+                    next_check_at REAL DEFAULT 0,
+                    status_changed_at REAL,
+                    owner_type TEXT,
+                    owner_id INTEGER,
+                    owner_access_hash INTEGER,
+                    owner_session TEXT,
+                    owner_contact INTEGER DEFAULT 0
+                )
+            ''')
+            
+            # Миграция баз, созданных до появления планировщика
+            cursor = await db.execute('PRAGMA table_info(usernames)')
+            columns = {row[1] for row in await cursor.fetchall()}
+            for column, definition in (
+                ('priority', 'INTEGER DEFAULT 0'),
+                ('next_check_at', 'REAL DEFAULT 0'),
+                ('status_changed_at', 'REAL'),
+                ('owner_type', 'TEXT'),
+                ('owner_id', 'INTEGER'),
+                ('owner_access_hash', 'INTEGER'),
+                ('owner_session', 'TEXT'),
+                ('owner_contact', 'INTEGER DEFAULT 0'),
+            ):
+                if column not in columns:
+                    await db.execute(f'ALTER TABLE usernames ADD COLUMN {column} {definition}')
+            
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_usernames_next_check ON usernames (next_check_at)'
+            )
+            
+            # Частичные индексы: строки без владельца и не 'free' (в том числе
+            # все новые строки при импорте) в них не попадают
+            await db.execute('DROP INDEX IF EXISTS idx_usernames_owner')
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_usernames_owner_id ON usernames (owner_id) '
+                'WHERE owner_id IS NOT NULL'
+            )
+            await db.execute('DROP INDEX IF EXISTS idx_usernames_status')
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_usernames_free ON usernames (status) "
+                "WHERE status = 'free'"
+            )
+            
+            # Счетчики по статусам для статистики. Удаление и смену статуса
+            # учитывают триггеры, вставки - _count_inserted в той же транзакции
+            # (построчный триггер вдвое замедлял массовый импорт)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS status_counts (
+                    status TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL DEFAULT 0
                 )
             ''')
             
+            await db.execute('DROP TRIGGER IF EXISTS trg_status_counts_insert')
+            
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_status_counts_delete AFTER DELETE ON usernames
+                BEGIN
+                    UPDATE status_counts SET count = count - 1 WHERE status = OLD.status;
+                END
+            ''')
+            
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_status_counts_update AFTER UPDATE OF status ON usernames
+                WHEN OLD.status IS NOT NEW.status
+                BEGIN
+                    UPDATE status_counts SET count = count - 1 WHERE status = OLD.status;
+                    INSERT INTO status_counts (status, count) VALUES (NEW.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET count = count + 1;
+                END
+            ''')
+            
+            # Пересчет при старте: база могла меняться версией без триггеров
+            await db.execute('DELETE FROM status_counts')
+            await db.execute(
+                'INSERT INTO status_counts (status, count) '
+                'SELECT status, COUNT(*) FROM usernames GROUP BY status'
+            )
+            
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS settings (
                     key TEXT PRIMARY KEY,
@@ -39,129 +256,397 @@ class Database:
                 )
             ''')
             
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_logs_username ON logs (username, timestamp)'
+            )
+            
+            # Уведомления к доставке, по строке на username и получателя. Строка
+            # пишется в одной транзакции со сменой статуса и удаляется вместе
+            # с пометкой notified после отправки
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL
+                )
+            ''')
+            
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox (next_attempt_at)'
+            )
+            
             await db.execute('''
                 INSERT OR IGNORE INTO settings (key, value) VALUES 
                 ('monitoring_active', '0'),
-                ('check_interval', '1'),
-                ('batch_size', '50'),
+                ('check_interval', ?),
+                ('batch_size', ?),
                 ('spam_delay', '0.5'),
                 ('spam_mode', 'count'),
                 ('spam_message_count', '10'),
                 ('spam_chat_id', '')
-            ''')
-            
-            await db.commit()
+            ''', (str(config.CHECK_INTERVAL), str(config.CHECK_BATCH_SIZE)))
+        
+        await self._mark_invalid_usernames()
+    
+    async def _mark_invalid_usernames(self):
+        """Помечает 'invalid' username с недопустимым форматом, добавленные старыми версиями.
+        
+        Username с недопустимым форматом никогда не отправляются в API. Новые
+        строки проверяются при добавлении, поэтому обход продолжается с
+        сохраненного id и после первого прохода читает только новые строки.
+        """
+        async for rows in self.iter_username_pages(cursor_key='invalid_sweep_cursor'):
+            invalid = [
+                (row['id'],) for row in rows
+                if row['status'] != 'invalid' and not is_valid_username(row['username'])
+            ]
+            if invalid:
+                async with self._write(background=True) as db:
+                    await db.executemany(
+                        "UPDATE usernames SET status = 'invalid', next_check_at = NULL WHERE id = ?",
+                        invalid
+                    )
+    
+    @staticmethod
+    async def _count_inserted(db: aiosqlite.Connection, status: str, count: int):
+        if count > 0:
+            await db.execute(
+                'INSERT INTO status_counts (status, count) VALUES (?, ?) '
+                'ON CONFLICT(status) DO UPDATE SET count = count + excluded.count',
+                (status, count)
+            )
     
     async def add_username(self, username: str) -> bool:
         username = username.lstrip('@').lower()
-        async with self._lock:
-            try:
-                async with aiosqlite.connect(self.db_path) as db:
-                    await db.execute(
-                        'INSERT INTO usernames (username, status) VALUES (?, ?)',
-                        (username, 'unknown')
-                    )
-                    await db.commit()
-                return True
-            except aiosqlite.IntegrityError:
-                return False
+        status, next_check_at = ('unknown', 0) if is_valid_username(username) else ('invalid', None)
+        try:
+            async with self._write() as db:
+                await db.execute(
+                    'INSERT INTO usernames (username, status, next_check_at) VALUES (?, ?, ?)',
+                    (username, status, next_check_at)
+                )
+                await self._count_inserted(db, status, 1)
+            return True
+        except aiosqlite.IntegrityError:
+            return False
     
     async def add_usernames_bulk(self, usernames: List[str]) -> Dict[str, int]:
+        """Добавляет username пачками по DB_WRITE_CHUNK_SIZE, по одной фоновой транзакции на пачку.
+        
+        Дубликаты (в базе и внутри списка) пропускаются через INSERT OR IGNORE.
+        """
         added = 0
         skipped = 0
+        invalid = 0
         
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
-                for username in usernames:
-                    username = username.lstrip('@').lower().strip()
-                    if not username:
-                        continue
-                    try:
-                        await db.execute(
-                            'INSERT INTO usernames (username, status) VALUES (?, ?)',
-                            (username, 'unknown')
-                        )
-                        added += 1
-                    except aiosqlite.IntegrityError:
-                        skipped += 1
-                await db.commit()
+        for i in range(0, len(usernames), config.DB_WRITE_CHUNK_SIZE):
+            normalized = [u.lstrip('@').lower().strip() for u in usernames[i:i + config.DB_WRITE_CHUNK_SIZE]]
+            normalized = [u for u in normalized if u]
+            unique = list(dict.fromkeys(normalized))
+            
+            # Недопустимые username сохраняем со статусом 'invalid' без планирования проверок
+            valid_rows = []
+            invalid_rows = []
+            for username in unique:
+                (valid_rows if is_valid_username(username) else invalid_rows).append((username,))
+            
+            async with self._write(background=True) as db:
+                cursor = await db.executemany(
+                    "INSERT OR IGNORE INTO usernames (username, status, next_check_at) "
+                    "VALUES (?, 'unknown', 0)",
+                    valid_rows
+                )
+                batch_added = max(cursor.rowcount, 0)
+                cursor = await db.executemany(
+                    "INSERT OR IGNORE INTO usernames (username, status, next_check_at) "
+                    "VALUES (?, 'invalid', NULL)",
+                    invalid_rows
+                )
+                batch_invalid = max(cursor.rowcount, 0)
+                await self._count_inserted(db, 'unknown', batch_added)
+                await self._count_inserted(db, 'invalid', batch_invalid)
+            
+            added += batch_added
+            invalid += batch_invalid
+            skipped += len(normalized) - batch_added - batch_invalid
         
-        return {'added': added, 'skipped': skipped}
+        return {'added': added, 'skipped': skipped, 'invalid': invalid}
     
     async def remove_username(self, username: str) -> bool:
         username = username.lstrip('@').lower()
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
+            cursor = await db.execute(
+                'DELETE FROM usernames WHERE username = ?',
+                (username,)
+            )
+        return cursor.rowcount > 0
+    
+    async def iter_username_pages(self, page_size: int = config.KEYSET_PAGE_SIZE,
+                                  cursor_key: Optional[str] = None):
+        """Обходит usernames страницами по первичному ключу (WHERE id > ? LIMIT ?).
+        
+        Каждая страница - список строк-словарей, читается отдельным коротким
+        запросом: память ограничена размером страницы, и обход не держит
+        открытую транзакцию чтения. С cursor_key id последней обработанной
+        строки сохраняется в settings, и следующий обход (в том числе после
+        перезапуска) продолжается с него.
+        """
+        last_id = await self.get_setting_as(cursor_key, int, 0) if cursor_key else 0
+        while True:
+            async with self._read() as db:
                 cursor = await db.execute(
-                    'DELETE FROM usernames WHERE username = ?',
-                    (username,)
+                    'SELECT * FROM usernames WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, page_size)
                 )
-                await db.commit()
-                return cursor.rowcount > 0
+                cursor.row_factory = aiosqlite.Row
+                rows = [dict(row) for row in await cursor.fetchall()]
+            if not rows:
+                break
+            
+            yield rows
+            
+            # Страница считается обработанной, когда потребитель запросил следующую
+            last_id = rows[-1]['id']
+            if cursor_key:
+                await self.set_setting(cursor_key, str(last_id))
+    
+    async def get_due_usernames(self, limit: int) -> List[str]:
+        """Возвращает username, время проверки которых уже наступило, по порядку очереди.
+        
+        Свободные username сюда не попадают: их перепроверяет отдельный цикл.
+        """
+        async with self._read() as db:
+            cursor = await db.execute(
+                "SELECT username FROM usernames WHERE next_check_at <= ? AND status != 'free' "
+                'ORDER BY next_check_at LIMIT ?',
+                (time.time(), limit)
+            )
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+    
+    async def get_due_owned_usernames(self, limit: int) -> List[str]:
+        """Занятые username с известным владельцем, время проверки которых наступило"""
+        async with self._read() as db:
+            cursor = await db.execute(
+                "SELECT username FROM usernames WHERE next_check_at <= ? AND status = 'occupied' "
+                'AND owner_id IS NOT NULL ORDER BY next_check_at LIMIT ?',
+                (time.time(), limit)
+            )
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
     
-    async def get_all_usernames(self) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_owners(self, usernames: List[str]) -> Dict[str, tuple]:
+        """Владельцы занятых username: username -> (type, id, access_hash, session)"""
+        if not usernames:
+            return {}
+        placeholders = ','.join('?' * len(usernames))
+        async with self._read() as db:
             cursor = await db.execute(
-                'SELECT * FROM usernames ORDER BY created_at DESC'
+                f'SELECT username, owner_type, owner_id, owner_access_hash, owner_session '
+                f"FROM usernames WHERE username IN ({placeholders}) "
+                f"AND status = 'occupied' AND owner_id IS NOT NULL",
+                usernames
             )
             rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            return {row[0]: tuple(row[1:]) for row in rows}
     
-    async def get_usernames_for_check(self) -> List[str]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('SELECT username FROM usernames')
+    async def get_usernames_by_owner(self, owner_type: str, owner_id: int) -> List[str]:
+        async with self._read() as db:
+            cursor = await db.execute(
+                'SELECT username FROM usernames WHERE owner_id = ? AND owner_type = ?',
+                (owner_id, owner_type)
+            )
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
     
+    async def get_owners_without_contact(self, limit: int) -> Dict[str, tuple]:
+        """Владельцы-пользователи, еще не добавленные в контакты"""
+        async with self._read() as db:
+            cursor = await db.execute(
+                'SELECT username, owner_type, owner_id, owner_access_hash, owner_session '
+                "FROM usernames WHERE owner_type = 'user' AND owner_contact = 0 "
+                "AND status = 'occupied' LIMIT ?",
+                (limit,)
+            )
+            rows = await cursor.fetchall()
+            return {row[0]: tuple(row[1:]) for row in rows}
+    
+    async def mark_owner_contacts(self, usernames: List[str]):
+        async with self._write() as db:
+            await db.executemany(
+                'UPDATE usernames SET owner_contact = 1 WHERE username = ?',
+                [(u,) for u in usernames]
+            )
+    
+    async def get_next_check_time(self) -> Optional[float]:
+        """Время (unix) ближайшей запланированной проверки"""
+        async with self._read() as db:
+            cursor = await db.execute("SELECT MIN(next_check_at) FROM usernames WHERE status != 'free'")
+            row = await cursor.fetchone()
+            return row[0] if row else None
+    
+    async def set_priority(self, usernames: List[str], priority: int) -> int:
+        """Устанавливает приоритет и ставит username в очередь на немедленную проверку"""
+        usernames = [u.lstrip('@').lower().strip() for u in usernames]
+        async with self._write() as db:
+            cursor = await db.executemany(
+                "UPDATE usernames SET priority = ?, "
+                "next_check_at = CASE WHEN status = 'invalid' THEN NULL ELSE 0 END "
+                "WHERE username = ?",
+                [(priority, u) for u in usernames if u]
+            )
+            return cursor.rowcount
+    
     async def get_free_usernames(self) -> List[str]:
         """Получает список username со статусом 'free'"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._read() as db:
             cursor = await db.execute(
                 "SELECT username FROM usernames WHERE status = 'free'"
             )
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
     
-    async def update_username_status(self, username: str, status: str):
-        username = username.lstrip('@').lower()
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
+    async def update_statuses(self, results: List[tuple]) -> Dict[str, Optional[str]]:
+        """Записывает пачку результатов (username, status, owner) одной транзакцией.
+        
+        owner - (type, id, access_hash, session) владельца занятого username.
+        Для занятого username без owner сохраненный владелец не меняется,
+        для остальных статусов владелец сбрасывается. Ошибка проверки ('error')
+        не затирает последний известный статус: меняется только время проверки.
+        Возвращает прежние статусы: username -> old_status (None, если username нет в базе).
+        """
+        latest = {}
+        for username, status, owner in results:
+            latest[username.lstrip('@').lower()] = (status, owner)
+        if not latest:
+            return {}
+        usernames = list(latest)
+        
+        async with self._write() as db:
+            # Прежнее состояние читаем в той же транзакции, что и запись
+            rows = {}
+            recent_changes = {}
+            for i in range(0, len(usernames), config.DB_IN_CHUNK_SIZE):
+                chunk = usernames[i:i + config.DB_IN_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
                 cursor = await db.execute(
-                    'SELECT status FROM usernames WHERE username = ?',
-                    (username,)
+                    f'SELECT username, status, priority, status_changed_at FROM usernames '
+                    f'WHERE username IN ({placeholders})',
+                    chunk
                 )
-                row = await cursor.fetchone()
-                old_status = row[0] if row else None
+                for row in await cursor.fetchall():
+                    rows[row[0]] = tuple(row[1:])
                 
-                await db.execute(
-                    'UPDATE usernames SET status = ?, last_check = ? WHERE username = ?',
-                    (status, datetime.now(), username)
+                cursor = await db.execute(
+                    f"SELECT username, COUNT(*) FROM logs WHERE username IN ({placeholders}) "
+                    f"AND timestamp >= datetime('now', ?) "
+                    f"AND old_status != 'error' AND new_status != 'error' GROUP BY username",
+                    (*chunk, f'-{config.STATUS_CHANGE_WINDOW} seconds')
                 )
+                recent_changes.update(await cursor.fetchall())
+            
+            now = time.time()
+            checked_at = datetime.now()
+            old_statuses = {}
+            status_rows = []
+            owner_rows = []
+            owner_resets = []
+            log_rows = []
+            outbox_rows = []
+            
+            for username, (status, owner) in latest.items():
+                old_status, priority, status_changed_at = rows.get(
+                    username, (None, config.DEFAULT_PRIORITY, None)
+                )
+                old_statuses[username] = old_status
                 
-                if old_status and old_status != status:
-                    await db.execute(
-                        'INSERT INTO logs (username, old_status, new_status) VALUES (?, ?, ?)',
-                        (username, old_status, status)
-                    )
+                # Переходы через 'error' не считаются сменой статуса
+                if status != 'error' and (
+                    status_changed_at is None
+                    or (old_status != status and old_status != 'error')
+                ):
+                    status_changed_at = now
+                
+                interval = compute_check_interval(
+                    priority,
+                    status,
+                    occupied_for=now - status_changed_at if status_changed_at else 0,
+                    recent_changes=recent_changes.get(username, 0)
+                )
+                
+                # 'invalid' больше не проверяется
+                next_check_at = None if status == 'invalid' else now + interval
+                # После ошибки остается последний известный статус, иначе свободный
+                # username выпал бы из списка свободных и при следующей удачной
+                # проверке дал бы повторное уведомление
+                stored_status = old_status if status == 'error' and old_status else status
+                status_rows.append((stored_status, checked_at, status_changed_at, next_check_at, status, username))
+                
+                # Username освободился - уведомление переживет перезапуск
+                if status == 'free' and old_status is not None and old_status != 'free':
+                    outbox_rows.extend((username, chat_id, now, now) for chat_id in config.ADMIN_IDS)
+                
+                if owner is not None and status == 'occupied':
+                    owner_rows.append((*owner, owner[1], username))
+                elif status not in ('occupied', 'error'):
+                    owner_resets.append((username,))
                 
-                await db.commit()
-                return old_status
+                if old_status and old_status != stored_status:
+                    log_rows.append((username, old_status, stored_status))
+            
+            # Флаг notified сбрасывается, как только username перестал быть свободным
+            await db.executemany(
+                'UPDATE usernames SET status = ?, last_check = ?, status_changed_at = ?, '
+                "next_check_at = ?, notified = CASE WHEN ? IN ('free', 'error') THEN notified ELSE 0 END "
+                'WHERE username = ?',
+                status_rows
+            )
+            
+            if owner_rows:
+                await db.executemany(
+                    'UPDATE usernames SET owner_type = ?, owner_id = ?, owner_access_hash = ?, '
+                    'owner_session = ?, owner_contact = '
+                    'CASE WHEN owner_id = ? THEN owner_contact ELSE 0 END WHERE username = ?',
+                    owner_rows
+                )
+            
+            if owner_resets:
+                await db.executemany(
+                    'UPDATE usernames SET owner_type = NULL, owner_id = NULL, '
+                    'owner_access_hash = NULL, owner_session = NULL, owner_contact = 0 '
+                    'WHERE username = ?',
+                    owner_resets
+                )
+            
+            if log_rows:
+                await db.executemany(
+                    'INSERT INTO logs (username, old_status, new_status) VALUES (?, ?, ?)',
+                    log_rows
+                )
+            
+            if outbox_rows:
+                await db.executemany(
+                    'INSERT INTO outbox (username, chat_id, created_at, next_attempt_at) VALUES (?, ?, ?, ?)',
+                    outbox_rows
+                )
+        
+        return old_statuses
     
     async def mark_as_notified(self, username: str):
         username = username.lstrip('@').lower()
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    'UPDATE usernames SET notified = 1 WHERE username = ?',
-                    (username,)
-                )
-                await db.commit()
+        async with self._write() as db:
+            await db.execute(
+                'UPDATE usernames SET notified = 1 WHERE username = ?',
+                (username,)
+            )
     
     async def is_notified(self, username: str) -> bool:
         """Проверяет, было ли отправлено уведомление для username"""
         username = username.lstrip('@').lower()
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._read() as db:
             cursor = await db.execute(
                 'SELECT notified FROM usernames WHERE username = ?',
                 (username,)
@@ -172,74 +657,106 @@ class Database:
     async def reset_notified(self, username: str):
         """Сбрасывает флаг уведомления для username"""
         username = username.lstrip('@').lower()
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    'UPDATE usernames SET notified = 0 WHERE username = ?',
-                    (username,)
-                )
-                await db.commit()
-    
-    async def get_statistics(self) -> Dict:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('SELECT COUNT(*) FROM usernames')
-            total = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM usernames WHERE status = 'occupied'"
+        async with self._write() as db:
+            await db.execute(
+                'UPDATE usernames SET notified = 0 WHERE username = ?',
+                (username,)
             )
-            occupied = (await cursor.fetchone())[0]
-            
+    
+    async def get_outbox_batch(self, limit: int) -> List[tuple]:
+        """Уведомления, которые пора отправить: (id, username, chat_id, attempts, status)"""
+        async with self._read() as db:
             cursor = await db.execute(
-                "SELECT COUNT(*) FROM usernames WHERE status = 'free'"
+                'SELECT o.id, o.username, o.chat_id, o.attempts, u.status FROM outbox o '
+                'LEFT JOIN usernames u ON u.username = o.username '
+                'WHERE o.next_attempt_at <= ? ORDER BY o.next_attempt_at, o.id LIMIT ?',
+                (time.time(), limit)
             )
-            free = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM usernames WHERE status = 'error'"
+            return await cursor.fetchall()
+    
+    async def get_next_outbox_time(self) -> Optional[float]:
+        """Время (unix) ближайшей попытки отправки из outbox"""
+        async with self._read() as db:
+            cursor = await db.execute('SELECT MIN(next_attempt_at) FROM outbox')
+            row = await cursor.fetchone()
+            return row[0] if row else None
+    
+    async def complete_outbox(self, ids: List[int], notified_usernames: List[str]):
+        """Удаляет отправленные уведомления и помечает username одной транзакцией"""
+        if not ids:
+            return
+        async with self._write() as db:
+            await db.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+            await db.executemany(
+                'UPDATE usernames SET notified = 1 WHERE username = ?',
+                [(username,) for username in notified_usernames]
             )
-            error = (await cursor.fetchone())[0]
-            
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM usernames WHERE status = 'unknown'"
+    
+    async def retry_outbox(self, retries: List[tuple]):
+        """Откладывает неотправленные уведомления: (id, next_attempt_at)"""
+        async with self._write() as db:
+            await db.executemany(
+                'UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?',
+                [(next_attempt_at, outbox_id) for outbox_id, next_attempt_at in retries]
             )
-            unknown = (await cursor.fetchone())[0]
+    
+    async def get_statistics(self) -> Dict:
+        async with self._read() as db:
+            cursor = await db.execute('SELECT status, count FROM status_counts')
+            counts = dict(await cursor.fetchall())
             
             return {
-                'total': total,
-                'occupied': occupied,
-                'free': free,
-                'error': error,
-                'unknown': unknown
+                'total': sum(counts.values()),
+                'occupied': counts.get('occupied', 0),
+                'free': counts.get('free', 0),
+                'error': counts.get('error', 0),
+                'unknown': counts.get('unknown', 0),
+                'invalid': counts.get('invalid', 0)
             }
     
     async def get_setting(self, key: str) -> Optional[str]:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                'SELECT value FROM settings WHERE key = ?',
-                (key,)
-            )
-            row = await cursor.fetchone()
-            return row[0] if row else None
+        if self._settings is None:
+            async with self._read() as db:
+                cursor = await db.execute('SELECT key, value FROM settings')
+                self._settings = dict(await cursor.fetchall())
+        return self._settings.get(key)
+    
+    async def get_setting_as(self, key: str, cast: Callable[[str], Any], default: Any) -> Any:
+        """Настройка, приведенная к типу cast; default, если ее нет или значение некорректно"""
+        value = await self.get_setting(key)
+        if value is None:
+            return default
+        try:
+            return cast(value)
+        except ValueError:
+            return default
     
     async def set_setting(self, key: str, value: str):
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
-                    (key, value)
-                )
-                await db.commit()
+        async with self._write() as db:
+            await db.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                (key, value)
+            )
+        if self._settings is not None:
+            self._settings[key] = value
+        for listener in list(self._setting_listeners):
+            listener(key, value)
+    
+    def subscribe_settings(self, listener: Callable[[str, str], None]):
+        """listener(key, value) вызывается после каждого set_setting"""
+        self._setting_listeners.append(listener)
+    
+    def unsubscribe_settings(self, listener: Callable[[str, str], None]):
+        if listener in self._setting_listeners:
+            self._setting_listeners.remove(listener)
     
     async def clear_all_usernames(self):
-        async with self._lock:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('DELETE FROM usernames')
-                await db.commit()
-    
-    async def export_usernames(self) -> str:
-        usernames = await self.get_all_usernames()
-        lines = []
-        for u in usernames:
-            lines.append(f"@{u['username']},{u['status']},{u['last_check'] or 'never'}")
-        return '\n'.join(lines)
+        # Удаляем частями: каждая строка проходит через триггер счетчиков
+        while True:
+            async with self._write(background=True) as db:
+                cursor = await db.execute(
+                    'DELETE FROM usernames WHERE id IN (SELECT id FROM usernames LIMIT ?)',
+                    (config.DB_WRITE_CHUNK_SIZE,)
+                )
+            if cursor.rowcount < config.DB_WRITE_CHUNK_SIZE:
+                break
@@ -0,0 +1,57 @@
+import csv
+import gzip
+import io
+import os
+from contextlib import aclosing
+from typing import List
+import config
+
+def _open_part(path: str, compress: bool):
+    raw = open(path, 'wb')
+    if compress:
+        out = io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb'), encoding='utf-8', newline='')
+    else:
+        out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    return raw, out
+
+def _close_part(raw, out):
+    out.close()
+    raw.close()
+
+async def export_usernames(db, directory: str, compress: bool = config.EXPORT_GZIP,
+                           part_size: int = config.EXPORT_PART_SIZE) -> List[str]:
+    """Пишет базу в CSV (username,status,last_check) в directory и возвращает пути частей.
+    
+    Строки читаются постранично по id, поэтому память не зависит от размера
+    базы. Новая часть начинается, когда текущая превышает part_size байт.
+    """
+    suffix = '.csv.gz' if compress else '.csv'
+    paths = []
+    raw = out = writer = None
+    try:
+        async with aclosing(db.iter_username_pages(config.EXPORT_FETCH_SIZE)) as pages:
+            async for rows in pages:
+                if raw is None or raw.tell() >= part_size:
+                    if raw is not None:
+                        _close_part(raw, out)
+                    path = os.path.join(directory, f'usernames_export_part{len(paths) + 1}{suffix}')
+                    raw, out = _open_part(path, compress)
+                    writer = csv.writer(out, lineterminator='\n')
+                    paths.append(path)
+                
+                writer.writerows(
+                    (f"@{row['username']}", row['status'], row['last_check'] or 'never')
+                    for row in rows
+                )
+                # Сбрасываем буферы, чтобы raw.tell() отражал реальный размер части
+                out.flush()
+    finally:
+        if raw is not None:
+            _close_part(raw, out)
+    
+    if len(paths) == 1:
+        single_path = os.path.join(directory, f'usernames_export{suffix}')
+        os.replace(paths[0], single_path)
+        paths = [single_path]
+    
+    return paths
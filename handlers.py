@@ -1,13 +1,20 @@
 import logging
 import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from io import BytesIO
 import keyboards
 import config
+from exporter import export_usernames
+from importer import is_supported_file, iter_username_batches
+from notifier import PRIORITY_SPAM, format_free_text
+from scheduler import parse_priority
 from telethon_auth import authorize_telethon
 
 logger = logging.getLogger(__name__)
@@ -25,6 +32,7 @@ class UserStates(StatesGroup):
     waiting_for_password = State()
     waiting_for_spam_delay = State()
     waiting_for_spam_count = State()
+    waiting_for_priority = State()
 
 @router.message(Command("start"))
 async def cmd_start(message: Message, db, checker):
@@ -51,7 +59,7 @@ async def reset_session_confirm(callback: CallbackQuery):
     if callback.from_user.id not in config.ADMIN_IDS:
         await callback.answer("⛔ Недостаточно прав", show_alert=True)
         return
-
+    
     await callback.message.edit_text(
         "⚠️ <b>Сброс сессии Telethon</b>\n\n"
         "Текущая сессия будет удалена, и потребуется повторная авторизация.\n"
@@ -63,25 +71,25 @@ async def reset_session_confirm(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "confirm_reset_session")
-async def reset_session(callback: CallbackQuery, db, checker, bot, auth_handler):
+async def reset_session(callback: CallbackQuery, db, checker, notifier, auth_handler):
     if callback.from_user.id not in config.ADMIN_IDS:
         await callback.answer("⛔ Недостаточно прав", show_alert=True)
         return
-
+    
     checker.stop_monitoring()
     await db.set_setting('monitoring_active', '0')
-
+    
     await callback.message.edit_text(
         "🔄 <b>Сброс сессии...</b>\n\n"
         "Удаляем текущую сессию и запускаем повторную авторизацию.",
         parse_mode="HTML"
     )
-
+    
     await checker.reset_session()
-
+    
     asyncio.create_task(
         authorize_telethon(
-            bot,
+            notifier,
             checker,
             auth_handler,
             config.ADMIN_IDS,
@@ -89,7 +97,7 @@ async def reset_session(callback: CallbackQuery, db, checker, bot, auth_handler)
             delay=0
         )
     )
-
+    
     await callback.message.edit_text(
         "✅ <b>Сессия сброшена</b>\n\n"
         "Теперь пройдите авторизацию Telethon в этом чате.",
@@ -98,8 +106,66 @@ async def reset_session(callback: CallbackQuery, db, checker, bot, auth_handler)
     )
     await callback.answer()
 
+@router.callback_query(F.data == "sessions")
+async def show_sessions(callback: CallbackQuery, checker):
+    lines = []
+    for session in checker.sessions:
+        if not session.ready:
+            state_text = "🔴 Не авторизована"
+        elif session.is_parked():
+            state_text = f"⏸ FloodWait ещё {session.flood_wait_remaining():.0f}с"
+        else:
+            state_text = "🟢 Активна"
+        lines.append(f"<code>{session.session_name}</code> — {state_text}")
+    
+    await callback.message.edit_text(
+        "👥 <b>Сессии Telethon</b>\n\n"
+        + "\n".join(lines) +
+        "\n\nПроверки распределяются между всеми активными сессиями.\n"
+        "Добавить сессии можно через SESSION_NAMES в .env.",
+        reply_markup=keyboards.get_sessions_menu(checker.sessions),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("session_login:"))
+async def session_login(callback: CallbackQuery, checker, notifier, auth_handler):
+    if callback.from_user.id not in config.ADMIN_IDS:
+        await callback.answer("⛔ Недостаточно прав", show_alert=True)
+        return
+    
+    index = int(callback.data.split(":", 1)[1])
+    if index >= len(checker.sessions):
+        await callback.answer("⚠️ Сессия не найдена!", show_alert=True)
+        return
+    
+    if auth_handler.is_auth_in_progress():
+        await callback.answer("⏳ Авторизация уже идет. Дождитесь ее завершения.", show_alert=True)
+        return
+    
+    session = checker.sessions[index]
+    asyncio.create_task(
+        authorize_telethon(
+            notifier,
+            checker,
+            auth_handler,
+            config.ADMIN_IDS,
+            prompt_admin_id=callback.from_user.id,
+            delay=0,
+            session=session
+        )
+    )
+    
+    await callback.message.edit_text(
+        f"🔐 <b>Авторизация сессии</b> <code>{session.session_name}</code>\n\n"
+        "Следуйте инструкциям бота в этом чате.",
+        reply_markup=keyboards.get_back_button(),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
 @router.callback_query(F.data == "start_monitoring")
-async def start_monitoring(callback: CallbackQuery, db, checker, bot):
+async def start_monitoring(callback: CallbackQuery, db, checker, notifier, outbox):
     # Проверяем реальное состояние мониторинга, а не только БД
     # Это важно при перезапуске бота, когда в БД может остаться старое значение
     is_running = checker.is_running and checker._check_task is not None and not checker._check_task.done()
@@ -121,81 +187,26 @@ async def start_monitoring(callback: CallbackQuery, db, checker, bot):
     chat_id = callback.message.chat.id
     await db.set_setting('spam_chat_id', str(chat_id))
     
-    # Словарь для отслеживания активных спам-задач (чтобы не запускать несколько для одного username)
-    active_spam_tasks = {}
-    
-    async def start_spam_for_username(username: str):
-        """Запускает спам для username со статусом 'free'"""
-        username_clean = username.lstrip('@').lower()
-        
-        # Проверяем, не запущен ли уже спам для этого username
-        if username_clean in active_spam_tasks:
-            task = active_spam_tasks[username_clean]
-            if not task.done():
-                logger.debug(f"Spam already running for @{username_clean}, skipping")
-                return
-        
-        # Проверяем статус username в БД
-        all_usernames = await db.get_all_usernames()
-        username_data = next((u for u in all_usernames if u['username'] == username_clean), None)
-        
-        if not username_data or username_data['status'] != 'free':
-            logger.debug(f"Username @{username_clean} is not free (status: {username_data['status'] if username_data else 'not found'}), skipping spam")
-            return
-        
-        # Получаем настройки спама из БД
-        spam_chat_id_str = await db.get_setting('spam_chat_id') or ''
-        spam_delay = float(await db.get_setting('spam_delay') or '0.5')
-        
-        if not spam_chat_id_str:
-            logger.warning("spam_chat_id not set, skipping spam")
-            return
-        
-        spam_chat_id = int(spam_chat_id_str)
-        message_text = (
-            f"🎉 <b>USERNAME ОСВОБОДИЛСЯ!</b>\n\n"
-            f"@{username_clean}\n\n"
-            f"Быстрее регистрируйте!"
-        )
-        
-        # Отправка уведомлений админам
-        for admin_id in config.ADMIN_IDS:
-            try:
-                await bot.send_message(
-                    admin_id,
-                    f"🎉 <b>USERNAME ОСВОБОДИЛСЯ!</b>\n\n"
-                    f"@{username_clean}\n\n"
-                    f"Быстрее регистрируйте!",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Error sending notification to admin {admin_id}: {e}")
-        
-        # Для свободных username всегда используем режим 'until_occupied'
-        # чтобы спамить пока username не займется
-        logger.info(f"Starting spam for free username @{username_clean} (mode: until_occupied)")
-        task = asyncio.create_task(
-            spam_until_occupied(bot, checker, db, spam_chat_id, username_clean, message_text, spam_delay)
-        )
-        active_spam_tasks[username_clean] = task
-        
-        # Удаляем задачу из словаря когда она завершится
-        def cleanup_task(task_username):
-            if task_username in active_spam_tasks:
-                del active_spam_tasks[task_username]
-        
-        task.add_done_callback(lambda t: cleanup_task(username_clean))
-    
     async def notification_callback(username: str):
         """Callback при обнаружении освобождения username"""
-        try:
-            await start_spam_for_username(username)
-        except Exception as e:
-            logger.error(f"Error in notification_callback for @{username}: {e}")
+        # Уведомление уже записано в outbox вместе со статусом - будим доставку
+        outbox.wake()
+    
+    async def spam_handler(username: str):
+        """Напоминание после каждой проверки, подтвердившей, что username все еще свободен"""
+        # Одно напоминание на чат со всеми свободными username: за круг перепроверки
+        # неотправленный дайджест заменяется новым, а не копится по сообщению на username
+        usernames = sorted(checker.free_usernames)
+        for i in range(0, len(usernames), config.NOTIFY_DIGEST_LIMIT):
+            notifier.broadcast(
+                format_free_text(usernames[i:i + config.NOTIFY_DIGEST_LIMIT]),
+                PRIORITY_SPAM,
+                key=f"spam:{i // config.NOTIFY_DIGEST_LIMIT}"
+            )
     
     try:
         checker._check_task = asyncio.create_task(
-            checker.start_monitoring(db, notification_callback, spam_handler=start_spam_for_username)
+            checker.start_monitoring(db, notification_callback, spam_handler=spam_handler)
         )
         logger.info(f"Monitoring task created and started. Task: {checker._check_task}")
         
@@ -211,48 +222,6 @@ async def start_monitoring(callback: CallbackQuery, db, checker, bot):
         await db.set_setting('monitoring_active', '0')
         await callback.answer("❌ Ошибка при запуске мониторинга!", show_alert=True)
 
-async def spam_until_occupied(bot, checker, db, chat_id, username, message_text, delay):
-    """Спамит в чат пока username не займут"""
-    username_clean = username.lstrip('@').lower()
-    check_interval = 5.0  # Интервал проверки статуса (секунды)
-    
-    while True:
-        try:
-            # Проверяем, запущен ли мониторинг
-            if not checker.is_running:
-                logger.info(f"Monitoring stopped, stopping spam for @{username_clean}")
-                break
-            
-            # Отправляем сообщение всем администраторам
-            for admin_id in config.ADMIN_IDS:
-                try:
-                    await bot.send_message(
-                        admin_id,
-                        message_text,
-                        parse_mode="HTML"
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending spam message to admin {admin_id}: {e}")
-                    # Продолжаем даже если одно сообщение не отправилось
-            
-            await asyncio.sleep(delay)
-            
-            # Периодически проверяем статус username
-            # Проверяем каждые N сообщений или каждые check_interval секунд
-            status = await checker.check_username(username_clean)
-            
-            if status != 'free':
-                # Username занят, прекращаем спам
-                logger.info(f"Username @{username_clean} is now {status}, stopping spam")
-                break
-            
-            # Обновляем статус в БД
-            await db.update_username_status(username_clean, status)
-            
-        except Exception as e:
-            logger.error(f"Error in spam_until_occupied: {e}")
-            await asyncio.sleep(delay)
-
 @router.callback_query(F.data == "stop_monitoring")
 async def stop_monitoring(callback: CallbackQuery, db, checker):
     # Проверяем реальное состояние мониторинга
@@ -278,7 +247,7 @@ async def stop_monitoring(callback: CallbackQuery, db, checker):
     await callback.answer()
 
 @router.callback_query(F.data == "statistics")
-async def show_statistics(callback: CallbackQuery, db):
+async def show_statistics(callback: CallbackQuery, db, checker):
     stats = await db.get_statistics()
     is_active = await db.get_setting('monitoring_active')
     
@@ -292,8 +261,34 @@ async def show_statistics(callback: CallbackQuery, db):
         f"🟢 Свободно: <b>{stats['free']}</b>\n"
         f"⚠️ Ошибки: <b>{stats['error']}</b>\n"
         f"❓ Не проверено: <b>{stats['unknown']}</b>\n"
+        f"🚫 Недопустимые: <b>{stats['invalid']}</b>\n"
     )
     
+    rate_lines = []
+    for rate in checker.get_rate_stats():
+        if not rate['ready']:
+            continue
+        if rate['last_flood_wait_at']:
+            last_flood = datetime.fromtimestamp(rate['last_flood_wait_at']).strftime('%d.%m %H:%M:%S')
+            last_flood += f" ({rate['last_flood_wait_seconds']}с)"
+        else:
+            last_flood = "не было"
+        rate_lines.append(
+            f"<code>{rate['session_name']}</code>: <b>{rate['rate']:.2f}</b> запр/с, "
+            f"токенов {rate['tokens']:.1f}/{rate['capacity']}, "
+            f"FloodWait: {last_flood}"
+        )
+    if rate_lines:
+        text += "\n⚡ <b>Скорость проверки</b>\n" + "\n".join(rate_lines) + "\n"
+    
+    cache = checker.cache
+    lookups = cache.hits + cache.misses
+    if lookups:
+        text += (
+            f"\n🗂 Кэш: <b>{len(cache)}</b> записей, "
+            f"попаданий <b>{cache.hits * 100 / lookups:.0f}%</b>\n"
+        )
+    
     await callback.message.edit_text(
         text,
         reply_markup=keyboards.get_back_button(),
@@ -307,7 +302,8 @@ async def upload_db(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "📥 <b>Загрузка базы</b>\n\n"
         "Отправьте файл .txt или .csv со списком username.\n"
-        "Формат: один username на строку (с @ или без).\n\n"
+        "Формат: один username на строку (с @ или без).\n"
+        "Большие списки можно сжать в .gz или .zip.\n\n"
         "Отправьте /cancel для отмены.",
         parse_mode="HTML"
     )
@@ -316,30 +312,65 @@ async def upload_db(callback: CallbackQuery, state: FSMContext):
 @router.message(UserStates.waiting_for_file, F.document)
 async def process_file(message: Message, state: FSMContext, db):
     document = message.document
+    file_name = document.file_name or ''
     
-    if not (document.file_name.endswith('.txt') or document.file_name.endswith('.csv')):
-        await message.answer("⚠️ Поддерживаются только .txt и .csv файлы!")
+    if not is_supported_file(file_name):
+        await message.answer("⚠️ Поддерживаются только .txt и .csv файлы (можно в .gz или .zip)!")
         return
     
-    file = await message.bot.download(document)
-    content = file.read().decode('utf-8')
-    
-    usernames = []
-    for line in content.split('\n'):
-        line = line.strip()
-        if line and not line.startswith('#'):
-            if ',' in line:
-                username = line.split(',')[0].strip()
-            else:
-                username = line
-            usernames.append(username)
+    progress = await message.answer("⏳ Загрузка файла...")
     
-    result = await db.add_usernames_bulk(usernames)
+    # Файл скачивается на диск и читается пачками, чтобы память не зависела от размера списка
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file_name)[1])
+    os.close(fd)
+    result = {'added': 0, 'skipped': 0, 'invalid': 0}
+    batches = None
+    try:
+        await message.bot.download(document, destination=path)
+        
+        batches = iter_username_batches(path, file_name, config.IMPORT_BATCH_SIZE)
+        last_progress = time.monotonic()
+        while True:
+            # Чтение и распаковка - блокирующие операции, выносим их из event loop
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            
+            batch_result = await db.add_usernames_bulk(batch)
+            for key in result:
+                result[key] += batch_result[key]
+            
+            if time.monotonic() - last_progress >= config.IMPORT_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                try:
+                    await progress.edit_text(
+                        f"⏳ Импорт: обработано <b>{sum(result.values())}</b>, "
+                        f"добавлено <b>{result['added']}</b>",
+                        parse_mode="HTML"
+                    )
+                except Exception:
+                    pass
+    except Exception as e:
+        logger.error(f"Error importing {file_name}: {e}", exc_info=True)
+        await message.answer(
+            f"❌ Ошибка при импорте файла!\n\n"
+            f"Успели добавить: <b>{result['added']}</b>",
+            reply_markup=keyboards.get_main_menu(),
+            parse_mode="HTML"
+        )
+        await state.clear()
+        return
+    finally:
+        # Генератор держит файл открытым; на Windows открытый файл не удалить
+        if batches is not None:
+            batches.close()
+        os.remove(path)
     
     await message.answer(
         f"✅ <b>Загрузка завершена!</b>\n\n"
         f"Добавлено: <b>{result['added']}</b>\n"
-        f"Пропущено (дубликаты): <b>{result['skipped']}</b>",
+        f"Пропущено (дубликаты): <b>{result['skipped']}</b>\n"
+        f"Недопустимые (не проверяются): <b>{result['invalid']}</b>",
         reply_markup=keyboards.get_main_menu(),
         parse_mode="HTML"
     )
@@ -347,19 +378,25 @@ async def process_file(message: Message, state: FSMContext, db):
 
 @router.callback_query(F.data == "download_db")
 async def download_db(callback: CallbackQuery, db):
-    export_data = await db.export_usernames()
+    stats = await db.get_statistics()
     
-    if not export_data:
+    if not stats['total']:
         await callback.answer("⚠️ База данных пуста!", show_alert=True)
         return
     
-    file_bytes = export_data.encode('utf-8')
-    
-    await callback.message.answer_document(
-        document=BufferedInputFile(file_bytes, filename="usernames_export.csv"),
-        caption="📤 Экспорт базы данных\nФормат: username,status,last_check"
-    )
-    await callback.answer()
+    await callback.answer("⏳ Готовлю экспорт...")
+    
+    # Файлы пишутся потоково во временный каталог и удаляются после отправки
+    with tempfile.TemporaryDirectory() as directory:
+        paths = await export_usernames(db, directory)
+        for index, path in enumerate(paths, 1):
+            caption = "📤 Экспорт базы данных\nФормат: username,status,last_check"
+            if len(paths) > 1:
+                caption += f"\nЧасть {index}/{len(paths)}"
+            await callback.message.answer_document(
+                document=FSInputFile(path),
+                caption=caption
+            )
 
 @router.callback_query(F.data == "add_username")
 async def add_username(callback: CallbackQuery, state: FSMContext):
@@ -383,7 +420,8 @@ async def process_add_username(message: Message, state: FSMContext, db):
     await message.answer(
         f"✅ <b>Добавление завершено!</b>\n\n"
         f"Добавлено: <b>{result['added']}</b>\n"
-        f"Пропущено (дубликаты): <b>{result['skipped']}</b>",
+        f"Пропущено (дубликаты): <b>{result['skipped']}</b>\n"
+        f"Недопустимые (не проверяются): <b>{result['invalid']}</b>",
         reply_markup=keyboards.get_main_menu(),
         parse_mode="HTML"
     )
@@ -417,6 +455,45 @@ async def process_remove_username(message: Message, state: FSMContext, db):
         )
     await state.clear()
 
+@router.callback_query(F.data == "set_priority")
+async def set_priority(callback: CallbackQuery, state: FSMContext):
+    intervals = "\n".join(
+        f"<b>{priority}</b> — каждые ~{interval}с"
+        for priority, interval in sorted(config.PRIORITY_INTERVALS.items())
+    )
+    await state.set_state(UserStates.waiting_for_priority)
+    await callback.message.edit_text(
+        "🎯 <b>Приоритет проверки</b>\n\n"
+        "Отправьте приоритет и список username через пробел.\n"
+        "Пример: <code>3 durov telegram</code>\n\n"
+        f"{intervals}\n\n"
+        "Давно занятые username проверяются реже, часто менявшие статус - чаще.\n\n"
+        "Отправьте /cancel для отмены.",
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+@router.message(UserStates.waiting_for_priority)
+async def process_priority(message: Message, state: FSMContext, db):
+    parts = message.text.replace(',', ' ').split()
+    priority = parse_priority(parts[0]) if parts else None
+    
+    if priority is None or len(parts) < 2:
+        await message.answer(
+            f"⚠️ Формат: приоритет ({min(config.PRIORITY_INTERVALS)}-{max(config.PRIORITY_INTERVALS)}) "
+            f"и username через пробел!"
+        )
+        return
+    
+    updated = await db.set_priority(parts[1:], priority)
+    
+    await message.answer(
+        f"✅ Приоритет <b>{priority}</b> установлен для <b>{updated}</b> username",
+        reply_markup=keyboards.get_main_menu(),
+        parse_mode="HTML"
+    )
+    await state.clear()
+
 @router.callback_query(F.data == "clear_db")
 async def clear_db_confirm(callback: CallbackQuery):
     await callback.message.edit_text(
@@ -459,7 +536,8 @@ async def set_interval(callback: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.waiting_for_interval)
     await callback.message.edit_text(
         "⏱ <b>Установка интервала</b>\n\n"
-        "Отправьте новый интервал между батчами в секундах (1-60).\n\n"
+        "Отправьте новый интервал между батчами в секундах (0-60).\n"
+        "0 - без паузы, темп задает только лимит запросов сессий.\n\n"
         "Отправьте /cancel для отмены.",
         parse_mode="HTML"
     )
@@ -469,14 +547,14 @@ async def set_interval(callback: CallbackQuery, state: FSMContext):
 async def process_interval(message: Message, state: FSMContext, db):
     try:
         interval = int(message.text.strip())
-        if 1 <= interval <= 60:
+        if 0 <= interval <= 60:
             await db.set_setting('check_interval', str(interval))
             await message.answer(
                 f"✅ Интервал установлен: {interval}с",
                 reply_markup=keyboards.get_settings_menu()
             )
         else:
-            await message.answer("⚠️ Интервал должен быть от 1 до 60 секунд!")
+            await message.answer("⚠️ Интервал должен быть от 0 до 60 секунд!")
             return
     except ValueError:
         await message.answer("⚠️ Введите число!")
@@ -539,7 +617,9 @@ async def set_spam_delay(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "⏱ <b>Установка задержки между сообщениями</b>\n\n"
         "Отправьте задержку в секундах (0.1-10.0).\n"
-        "Например: 0.5 для полсекунды, 1.0 для секунды.\n\n"
+        "Например: 0.5 для полсекунды, 1.0 для секунды.\n"
+        f"Свободные username перепроверяются не чаще раза в {config.FREE_RECHECK_MIN_INTERVAL:g}с, "
+        "напоминание приходит после каждой проверки.\n\n"
         "Отправьте /cancel для отмены.",
         parse_mode="HTML"
     )
@@ -0,0 +1,49 @@
+import gzip
+import io
+import zipfile
+from typing import Iterator, List, Optional
+
+# Поддерживаемые файлы: .txt/.csv, а также они же в .gz или .zip
+SUPPORTED_EXTENSIONS = ('.txt', '.csv', '.gz', '.zip')
+
+def is_supported_file(file_name: str) -> bool:
+    return file_name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def parse_line(line: str) -> Optional[str]:
+    """Username из строки файла: один на строку или первый столбец CSV"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    return line.split(',', 1)[0].strip() or None
+
+def _iter_lines(path: str, file_name: str) -> Iterator[str]:
+    name = file_name.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as raw:
+                    yield from io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+    elif name.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as f:
+            yield from f
+    else:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            yield from f
+
+def iter_username_batches(path: str, file_name: str, batch_size: int) -> Iterator[List[str]]:
+    """Читает файл построчно и отдает username пачками, не загружая файл в память.
+
+    Архивы распаковываются на лету; тип определяется по имени файла.
+    """
+    batch = []
+    for line in _iter_lines(path, file_name):
+        username = parse_line(line)
+        if username:
+            batch.append(username)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
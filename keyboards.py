@@ -19,6 +19,7 @@ def get_main_menu() -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="⚙ Настройки", callback_data="settings")
         ],
         [
+            InlineKeyboardButton(text="🎯 Приоритет", callback_data="set_priority"),
             InlineKeyboardButton(text="🗑 Очистить базу", callback_data="clear_db")
         ]
     ])
@@ -35,6 +36,9 @@ def get_settings_menu() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(text="💬 Настройки спама", callback_data="spam_settings")
         ],
+        [
+            InlineKeyboardButton(text="👥 Сессии", callback_data="sessions")
+        ],
         [
             InlineKeyboardButton(text="🔐 Перевойти Telethon", callback_data="reset_session")
         ],
@@ -75,6 +79,20 @@ def get_spam_mode_keyboard() -> InlineKeyboardMarkup:
     ])
     return keyboard
 
+def get_sessions_menu(sessions) -> InlineKeyboardMarkup:
+    buttons = []
+    for index, session in enumerate(sessions):
+        if not session.ready:
+            buttons.append([
+                InlineKeyboardButton(
+                    text=f"🔐 Войти: {session.session_name}",
+                    callback_data=f"session_login:{index}"
+                )
+            ])
+    buttons.append([InlineKeyboardButton(text="🔄 Обновить", callback_data="sessions")])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="settings")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
 def get_confirm_keyboard(action: str) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -0,0 +1,414 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+import config
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты сообщений: меньше - раньше
+PRIORITY_ALERT = 0  # Первое уведомление об освободившемся username
+PRIORITY_NORMAL = 1
+PRIORITY_SPAM = 2  # Повторные напоминания
+
+class _Message(NamedTuple):
+    priority: int
+    seq: int
+    key: str
+    text: str
+    # Результат доставки для broadcast_and_wait
+    delivered: Optional[asyncio.Future] = None
+    # До какого момента (time.monotonic) отправитель ждет, пока сообщение в очереди
+    deadline: Optional[float] = None
+
+class _BotSlot:
+    """Бот из пула отправки со своим лимитом сообщений"""
+    
+    def __init__(self, bot):
+        self.bot = bot
+        self.next_send_at = 0.0
+        # Чаты, в которые этот бот писать не может (не запущен пользователем или заблокирован)
+        self.forbidden: Set[int] = set()
+
+class _ChatQueue:
+    """Очередь сообщений одного чата"""
+    
+    def __init__(self):
+        self.messages: Dict[str, _Message] = {}
+        # Номер бота в пуле -> когда ему можно снова писать в этот чат
+        self.ready_at: Dict[int, float] = {}
+        self.sending = False
+    
+    def best(self) -> Optional[_Message]:
+        if not self.messages:
+            return None
+        return min(self.messages.values())
+
+def format_free_text(usernames: List[str]) -> str:
+    if len(usernames) == 1:
+        return (
+            f"🎉 <b>USERNAME ОСВОБОДИЛСЯ!</b>\n\n"
+            f"@{usernames[0]}\n\n"
+            f"Быстрее регистрируйте!"
+        )
+    names = '\n'.join(f"@{username}" for username in usernames)
+    return (
+        f"🎉 <b>ОСВОБОДИЛИСЬ USERNAME ({len(usernames)})</b>\n\n"
+        f"{names}\n\n"
+        f"Быстрее регистрируйте!"
+    )
+
+class NotificationDispatcher:
+    """Единая очередь исходящих сообщений бота.
+    
+    Отправляет через пул ботов (все токены из BOT_TOKENS). Для каждого бота
+    соблюдается свой лимит Bot API (NOTIFY_GLOBAL_RATE сообщений/с) и пауза
+    NOTIFY_CHAT_INTERVAL между его сообщениями в один чат, поэтому пропускная
+    способность растет с числом токенов. Сообщения с одинаковым ключом
+    заменяют друг друга. При TelegramRetryAfter ждет только чат и бот,
+    получившие ошибку, остальные продолжают работать.
+    
+    Разные чаты обслуживаются параллельно (до NOTIFY_CONCURRENCY запросов),
+    у каждой отправки свой таймаут, поэтому медленный получатель не задерживает
+    остальных. Если чат не принимает сообщения от одного бота пула, ему пишут
+    другие; чаты, недоступные ни одному боту, запоминаются и пропускаются.
+    """
+    
+    def __init__(self, bots: List, rate: float = config.NOTIFY_GLOBAL_RATE,
+                 chat_interval: float = config.NOTIFY_CHAT_INTERVAL):
+        self._slots = [_BotSlot(bot) for bot in bots]
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._seq = itertools.count()
+        self._semaphore = asyncio.Semaphore(config.NOTIFY_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sends: Set[asyncio.Task] = set()
+        # Чаты, недоступные всем ботам пула (до следующего сообщения от них)
+        self.blocked: Set[int] = set()
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        tasks = list(self._sends)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def _chat(self, chat_id: int) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue()
+        return chat
+    
+    def unblock(self, chat_id: int):
+        """Снова пишет в чат, от которого пришло сообщение (бот разблокирован)"""
+        if chat_id in self.blocked:
+            logger.info(f"Chat {chat_id} unblocked the bot")
+            self.blocked.discard(chat_id)
+        for slot in self._slots:
+            slot.forbidden.discard(chat_id)
+    
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, key: Optional[str] = None):
+        """Ставит сообщение в очередь. Неотправленное сообщение с тем же key заменяется новым"""
+        if chat_id in self.blocked:
+            return
+        seq = next(self._seq)
+        key = key or f"msg:{seq}"
+        chat = self._chat(chat_id)
+        old = chat.messages.get(key)
+        if old is not None:
+            # Сохраняем место в очереди, меняем только текст
+            priority, seq = min(priority, old.priority), old.seq
+        chat.messages[key] = _Message(priority, seq, key, text)
+        self._wakeup.set()
+    
+    def broadcast(self, text: str, priority: int = PRIORITY_NORMAL, key: Optional[str] = None,
+                  chat_ids: Optional[Iterable[int]] = None):
+        for chat_id in (config.ADMIN_IDS if chat_ids is None else chat_ids):
+            self.send(chat_id, text, priority, key)
+    
+    async def broadcast_and_wait(self, text: str, chat_ids: Optional[Iterable[int]] = None,
+                                 priority: int = PRIORITY_NORMAL,
+                                 timeout: float = config.NOTIFY_SEND_TIMEOUT) -> Dict[int, bool]:
+        """Отправляет сообщение всем получателям одновременно и ждет результата.
+        
+        Возвращает chat_id -> доставлено ли. Сообщение, которое за timeout
+        секунд так и не ушло из очереди, снимается и считается недоставленным.
+        Уже начатую отправку дожидаемся: ее ограничивает таймаут _deliver,
+        а ложное "не доставлено" привело бы к повторной отправке.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        pending = {}
+        for chat_id in (config.ADMIN_IDS if chat_ids is None else chat_ids):
+            if chat_id in self.blocked:
+                continue
+            seq = next(self._seq)
+            message = _Message(priority, seq, f"msg:{seq}", text, loop.create_future(), deadline)
+            self._chat(chat_id).messages[message.key] = message
+            pending[chat_id] = message
+        self._wakeup.set()
+        
+        futures = [m.delivered for m in pending.values()]
+        now = time.monotonic()
+        while futures and now < deadline:
+            done, _ = await asyncio.wait(futures, timeout=deadline - now)
+            if len(done) == len(futures):
+                break
+            now = time.monotonic()
+        
+        for chat_id, message in pending.items():
+            chat = self._chats.get(chat_id)
+            if not message.delivered.done() and chat is not None and chat.messages.get(message.key) is message:
+                # Не дождались очереди - сообщение больше не нужно
+                del chat.messages[message.key]
+                message.delivered.set_result(False)
+        if futures:
+            await asyncio.wait(futures)
+        
+        results = {chat_id: False for chat_id in (config.ADMIN_IDS if chat_ids is None else chat_ids)}
+        for chat_id, message in pending.items():
+            results[chat_id] = message.delivered.result()
+        return results
+    
+    async def send_and_wait(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL) -> bool:
+        return (await self.broadcast_and_wait(text, [chat_id], priority))[chat_id]
+    
+    def _pick_slot(self, chat_id: int, chat: _ChatQueue, now: float) -> Optional[int]:
+        """Наименее загруженный бот пула, которому уже можно писать в чат"""
+        best = None
+        for index, slot in enumerate(self._slots):
+            if chat_id in slot.forbidden or chat.ready_at.get(index, 0.0) > now:
+                continue
+            if best is None or slot.next_send_at < self._slots[best].next_send_at:
+                best = index
+        return best
+    
+    def _take_next(self, now: float):
+        """Выбирает самое приоритетное сообщение среди чатов, в которые уже можно писать"""
+        best_chat_id = best = best_slot = None
+        for chat_id, chat in self._chats.items():
+            if chat.sending:
+                continue
+            message = chat.best()
+            if message is None or (best is not None and best < message):
+                continue
+            index = self._pick_slot(chat_id, chat, now)
+            if index is not None:
+                best_chat_id, best, best_slot = chat_id, message, index
+        if best is None:
+            return None, None, None
+        
+        del self._chats[best_chat_id].messages[best.key]
+        return best_chat_id, best, best_slot
+    
+    def _requeue(self, chat_id: int, message: _Message):
+        if message.delivered is not None:
+            if message.delivered.done():
+                # Отправитель уже не ждет результата
+                return
+            if time.monotonic() >= message.deadline:
+                # Сообщение не отправлено, а время ожидания в очереди вышло
+                message.delivered.set_result(False)
+                return
+        chat = self._chat(chat_id)
+        if message.key not in chat.messages:
+            # Более новое сообщение с тем же ключом уже в очереди - старое не нужно
+            chat.messages[message.key] = message
+    
+    def _wait_time(self, now: float) -> Optional[float]:
+        times = [
+            chat.ready_at.get(index, 0.0) - now
+            for chat_id, chat in self._chats.items()
+            if chat.messages and not chat.sending
+            for index, slot in enumerate(self._slots)
+            if chat_id not in slot.forbidden
+        ]
+        return max(0.0, min(times)) if times else None
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            chat_id, message, index = self._take_next(now)
+            if message is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._wait_time(now))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            chat = self._chats[chat_id]
+            chat.sending = True
+            try:
+                await self._semaphore.acquire()
+                # Лимит бота: его сообщения идут равномерно, не чаще rate в секунду
+                slot = self._slots[index]
+                now = time.monotonic()
+                slot.next_send_at = max(slot.next_send_at, now)
+                delay = slot.next_send_at - now
+                slot.next_send_at += 1 / self.rate
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            except BaseException:
+                chat.sending = False
+                self._requeue(chat_id, message)
+                raise
+            
+            task = asyncio.create_task(self._deliver(chat_id, message, index))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+    
+    async def _deliver(self, chat_id: int, message: _Message, index: int):
+        chat = self._chats[chat_id]
+        slot = self._slots[index]
+        started = time.monotonic()
+        delivered = False
+        try:
+            await asyncio.wait_for(
+                slot.bot.send_message(chat_id, message.text, parse_mode="HTML"),
+                config.NOTIFY_SEND_TIMEOUT
+            )
+            delivered = True
+        except TelegramRetryAfter as e:
+            logger.warning(f"Rate limit for chat {chat_id} on bot #{index + 1}, retry after {e.retry_after}s")
+            chat.ready_at[index] = time.monotonic() + e.retry_after
+            self._requeue(chat_id, message)
+            return
+        except TelegramForbiddenError as e:
+            slot.forbidden.add(chat_id)
+            if any(chat_id not in other.forbidden for other in self._slots):
+                # Пользователь не запускал этого бота - пишем через остальные
+                logger.warning(f"Bot #{index + 1} can't write to chat {chat_id}, using other bots: {e}")
+                self._requeue(chat_id, message)
+                return
+            logger.warning(f"Chat {chat_id} blocked the bot, skipping it until it writes again: {e}")
+            self.blocked.add(chat_id)
+            for pending in chat.messages.values():
+                if pending.delivered is not None and not pending.delivered.done():
+                    pending.delivered.set_result(False)
+            chat.messages.clear()
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out sending notification to {chat_id}")
+        except asyncio.CancelledError:
+            # Диспетчер остановлен - отправитель не должен ждать вечно
+            if message.delivered is not None and not message.delivered.done():
+                message.delivered.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Error sending notification to {chat_id}: {e}")
+        finally:
+            chat.ready_at[index] = max(chat.ready_at.get(index, 0.0), started + self.chat_interval)
+            chat.sending = False
+            self._semaphore.release()
+            self._wakeup.set()
+        
+        if message.delivered is not None and not message.delivered.done():
+            message.delivered.set_result(delivered)
+
+class OutboxWorker:
+    """Доставляет уведомления об освободившихся username из таблицы outbox.
+    
+    Строки outbox (по одной на username и получателя) пишутся в одной
+    транзакции со сменой статуса, поэтому уведомление переживает перезапуск
+    и ошибки отправки. Строки забираются пачками, username одного получателя
+    уходят ему одним дайджестом, получатели обслуживаются параллельно.
+    Отправленные строки удаляются вместе с пометкой notified одной транзакцией,
+    неотправленные откладываются с удваивающейся паузой.
+    """
+    
+    def __init__(self, db, notifier: NotificationDispatcher):
+        self.db = db
+        self.notifier = notifier
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    def wake(self):
+        """Проверить outbox сейчас, не дожидаясь следующего опроса"""
+        self._wakeup.set()
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self._deliver_batch():
+                    continue
+                next_attempt_at = await self.db.get_next_outbox_time()
+            except Exception as e:
+                logger.error(f"Error delivering outbox: {e}", exc_info=True)
+                await asyncio.sleep(5)
+                continue
+            
+            timeout = config.OUTBOX_POLL_INTERVAL
+            if next_attempt_at is not None:
+                timeout = min(timeout, max(next_attempt_at - time.time(), 0.0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _deliver_batch(self) -> bool:
+        """Отправляет одну пачку; False, если отправлять нечего"""
+        rows = await self.db.get_outbox_batch(config.NOTIFY_DIGEST_LIMIT * max(1, len(config.ADMIN_IDS)))
+        if not rows:
+            return False
+        
+        done = []
+        by_chat: Dict[int, Dict[str, List[tuple]]] = {}
+        for outbox_id, username, chat_id, attempts, status in rows:
+            if status != 'free' or chat_id in self.notifier.blocked:
+                # Username уже заняли или удалили, либо получатель заблокировал бота
+                done.append(outbox_id)
+            else:
+                by_chat.setdefault(chat_id, {}).setdefault(username, []).append((outbox_id, attempts))
+        
+        # Дайджест - не больше NOTIFY_DIGEST_LIMIT username, иначе текст
+        # может не влезть в лимит длины сообщения Telegram
+        digests = []
+        for chat_id, by_username in by_chat.items():
+            usernames = list(by_username)
+            for i in range(0, len(usernames), config.NOTIFY_DIGEST_LIMIT):
+                digests.append((chat_id, usernames[i:i + config.NOTIFY_DIGEST_LIMIT]))
+        
+        results = await asyncio.gather(*(
+            self.notifier.send_and_wait(chat_id, format_free_text(usernames), PRIORITY_ALERT)
+            for chat_id, usernames in digests
+        ))
+        
+        notified = set()
+        retries = []
+        now = time.time()
+        for (chat_id, usernames), delivered in zip(digests, results):
+            for username in usernames:
+                for outbox_id, attempts in by_chat[chat_id][username]:
+                    if delivered:
+                        done.append(outbox_id)
+                        notified.add(username)
+                    else:
+                        delay = min(config.OUTBOX_RETRY_MAX_DELAY, config.OUTBOX_RETRY_MIN_DELAY * 2 ** attempts)
+                        retries.append((outbox_id, now + delay))
+        
+        if retries:
+            logger.warning(f"Failed to deliver {len(retries)} notifications, will retry")
+            await self.db.retry_outbox(retries)
+        await self.db.complete_outbox(done, list(notified))
+        return True
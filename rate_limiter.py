@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveRateLimiter:
+    """Token bucket с адаптивной скоростью для одной сессии Telethon.
+
+    Скорость плавно растет после каждого успешного запроса и уменьшается
+    в RATE_BACKOFF_FACTOR раз при FloodWait, так что сессия работает
+    около реального лимита аккаунта, а не на угаданном безопасном значении.
+    """
+
+    def __init__(self, rate: float = config.RATE_INITIAL):
+        self.min_rate = config.RATE_MIN
+        self.max_rate = config.RATE_MAX
+        self.capacity = config.RATE_BURST
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+        self.tokens = float(self.capacity)
+        self.last_flood_wait_at: Optional[float] = None
+        self.last_flood_wait_seconds = 0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Ждет, пока в корзине появится токен, и забирает его"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + config.RATE_INCREASE_STEP)
+
+    def on_flood_wait(self, seconds: int):
+        old_rate = self.rate
+        self.rate = max(self.min_rate, self.rate * config.RATE_BACKOFF_FACTOR)
+        self.tokens = 0.0
+        self._updated = time.monotonic()
+        self.last_flood_wait_at = time.time()
+        self.last_flood_wait_seconds = seconds
+        logger.info(f"Rate backoff after FloodWait: {old_rate:.2f} -> {self.rate:.2f} req/s")
+
+    def get_state(self) -> Dict:
+        self._refill()
+        return {
+            'rate': self.rate,
+            'tokens': self.tokens,
+            'capacity': self.capacity,
+            'last_flood_wait_at': self.last_flood_wait_at,
+            'last_flood_wait_seconds': self.last_flood_wait_seconds
+        }
+
+    def dump(self) -> str:
+        return json.dumps({
+            'rate': self.rate,
+            'last_flood_wait_at': self.last_flood_wait_at,
+            'last_flood_wait_seconds': self.last_flood_wait_seconds
+        })
+
+    def load(self, data: str):
+        try:
+            state = json.loads(data)
+            self.rate = min(self.max_rate, max(self.min_rate, float(state['rate'])))
+            self.last_flood_wait_at = state.get('last_flood_wait_at')
+            self.last_flood_wait_seconds = state.get('last_flood_wait_seconds', 0)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Failed to load rate limiter state: {e}")
@@ -0,0 +1,37 @@
+import random
+from typing import Optional
+import config
+
+def compute_check_interval(
+    priority: int,
+    status: str,
+    occupied_for: float = 0.0,
+    recent_changes: int = 0
+) -> float:
+    """Вычисляет интервал до следующей проверки username (в секундах).
+
+    Базовый интервал задается приоритетом. Чем дольше username занят,
+    тем реже он проверяется; чем чаще он менял статус за последнее время,
+    тем чаще проверяется.
+    """
+    interval = config.PRIORITY_INTERVALS.get(
+        priority, config.PRIORITY_INTERVALS[config.DEFAULT_PRIORITY]
+    )
+
+    if status == 'occupied' and occupied_for > 0:
+        age_factor = 1 + occupied_for / config.OCCUPIED_AGE_STEP
+        interval *= min(age_factor, config.OCCUPIED_AGE_MAX_FACTOR)
+
+    interval /= 1 + recent_changes
+
+    # Небольшой разброс, чтобы username, добавленные одновременно, не проверялись пачкой
+    interval *= random.uniform(1 - config.CHECK_JITTER, 1 + config.CHECK_JITTER)
+
+    return min(config.MAX_CHECK_INTERVAL, max(config.MIN_CHECK_INTERVAL, interval))
+
+def parse_priority(value: str) -> Optional[int]:
+    try:
+        priority = int(value)
+    except ValueError:
+        return None
+    return priority if priority in config.PRIORITY_INTERVALS else None
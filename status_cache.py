@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import config
+
+class StatusCache:
+    """LRU-кэш результатов проверки username с отдельным TTL для каждого статуса.
+
+    Общий для цикла мониторинга и повторных проверок при спаме, поэтому
+    один и тот же username не запрашивается у API дважды в пределах TTL.
+    """
+
+    def __init__(self, max_size: int = config.STATUS_CACHE_SIZE,
+                 ttls: Optional[Dict[str, float]] = None):
+        self.max_size = max_size
+        self.ttls = ttls if ttls is not None else config.STATUS_CACHE_TTL
+        self._items: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return username.lstrip('@').lower()
+
+    def get(self, username: str) -> Optional[str]:
+        key = self._key(username)
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        status, expires_at = item
+        if time.monotonic() >= expires_at:
+            del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return status
+
+    def set(self, username: str, status: str):
+        ttl = self.ttls.get(status, 0)
+        key = self._key(username)
+        if ttl <= 0:
+            self._items.pop(key, None)
+            return
+
+        self._items[key] = (status, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, username: str):
+        self._items.pop(self._key(username), None)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
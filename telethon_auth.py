@@ -5,15 +5,25 @@ from typing import Iterable, Optional
 logger = logging.getLogger(__name__)
 
 async def authorize_telethon(
-    bot,
+    notifier,
     checker,
     auth_handler,
     admin_ids: Iterable[int],
     prompt_admin_id: Optional[int] = None,
-    delay: float = 2.0
+    delay: float = 2.0,
+    session=None
 ):
-    """Authorize Telethon via bot messages."""
-    logger.info("authorize_telethon called (delay=%s, prompt_admin_id=%s)", delay, prompt_admin_id)
+    """Authorize Telethon via bot messages.
+
+    By default authorizes the primary session; pass ``session`` to log in
+    one of the extra sessions from the checker pool. Prompts go out through
+    ``notifier`` to all target admins at once.
+    """
+    session = session or checker.primary_session
+    logger.info(
+        "authorize_telethon called (session=%s, delay=%s, prompt_admin_id=%s)",
+        session.session_name, delay, prompt_admin_id
+    )
     if auth_handler.is_auth_in_progress():
         logger.info("Authorization already in progress, skipping")
         return
@@ -33,65 +43,60 @@ async def authorize_telethon(
         logger.info("Authorization target admins: %s", target_admin_ids)
 
         logger.info("Connecting Telethon client...")
-        await checker.client.connect()
-        is_authorized = await checker.client.is_user_authorized()
+        await session.client.connect()
+        is_authorized = await session.client.is_user_authorized()
         logger.info("Telethon is_authorized=%s", is_authorized)
 
         if not is_authorized:
             logger.info("Telethon not authorized, will request auth via bot")
-            for admin_id in target_admin_ids:
-                await bot.send_message(
-                    admin_id,
-                    "⚠️ <b>Требуется авторизация Telethon</b>\n\n"
-                    "Сейчас начнется процесс авторизации.\n"
-                    "Следуйте инструкциям бота.",
-                    parse_mode="HTML"
-                )
+            await notifier.broadcast_and_wait(
+                "⚠️ <b>Требуется авторизация Telethon</b>\n\n"
+                f"Сессия: <code>{session.session_name}</code>\n"
+                "Сейчас начнется процесс авторизации.\n"
+                "Следуйте инструкциям бота.",
+                target_admin_ids
+            )
             auth_handler.set_prompt_admin_ids(target_admin_ids)
             logger.info("Starting Telethon client with auth callbacks...")
             await checker.start(
                 phone_callback=auth_handler.phone_callback,
                 code_callback=auth_handler.code_callback,
-                password_callback=auth_handler.password_callback
+                password_callback=auth_handler.password_callback,
+                session=session
             )
             logger.info("Telethon client started after authorization")
-            for admin_id in target_admin_ids:
-                await bot.send_message(
-                    admin_id,
-                    "✅ <b>Авторизация успешна!</b>\n\n"
-                    "Telethon клиент подключен и готов к работе.",
-                    parse_mode="HTML"
-                )
+            await notifier.broadcast_and_wait(
+                "✅ <b>Авторизация успешна!</b>\n\n"
+                "Telethon клиент подключен и готов к работе.",
+                target_admin_ids
+            )
         else:
             logger.info("Telethon already authorized")
             logger.info("Starting Telethon client (already authorized)...")
             await checker.start(
                 phone_callback=auth_handler.phone_callback,
                 code_callback=auth_handler.code_callback,
-                password_callback=auth_handler.password_callback
+                password_callback=auth_handler.password_callback,
+                session=session
             )
             logger.info("Telethon client started (already authorized)")
-            for admin_id in target_admin_ids:
-                await bot.send_message(
-                    admin_id,
-                    "✅ <b>Бот запущен!</b>\n\n"
-                    "Telethon клиент уже авторизован и готов к работе.",
-                    parse_mode="HTML"
-                )
+            await notifier.broadcast_and_wait(
+                "✅ <b>Бот запущен!</b>\n\n"
+                "Telethon клиент уже авторизован и готов к работе.",
+                target_admin_ids
+            )
     except Exception as e:
         logger.error(f"Error starting Telethon: {e}", exc_info=True)
-        for admin_id in target_admin_ids:
-            await bot.send_message(
-                admin_id,
-                f"❌ <b>Ошибка запуска Telethon</b>\n\n"
-                f"<code>{str(e)}</code>",
-                parse_mode="HTML"
-            )
+        await notifier.broadcast_and_wait(
+            f"❌ <b>Ошибка запуска Telethon</b>\n\n"
+            f"<code>{str(e)}</code>",
+            target_admin_ids
+        )
     finally:
         auth_handler.set_auth_in_progress(False)
 
 async def ensure_authorized(
-    bot,
+    notifier,
     checker,
     auth_handler,
     admin_ids: Iterable[int],
@@ -108,7 +113,7 @@ async def ensure_authorized(
 
     asyncio.create_task(
         authorize_telethon(
-            bot,
+            notifier,
             checker,
             auth_handler,
             admin_ids,
@@ -117,3 +122,19 @@ async def ensure_authorized(
         )
     )
     return False
+
+async def connect_extra_sessions(checker):
+    """Connect extra pool sessions that are already authorized.
+
+    Unauthorized sessions are skipped; they can be logged in from the bot.
+    """
+    for session in checker.sessions[1:]:
+        try:
+            await session.client.connect()
+            if await session.client.is_user_authorized():
+                session.ready = True
+                logger.info("Extra Telethon session %s connected", session.session_name)
+            else:
+                logger.info("Extra Telethon session %s is not authorized, skipping", session.session_name)
+        except Exception as e:
+            logger.error(f"Error connecting extra session {session.session_name}: {e}")
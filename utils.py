@@ -1,6 +1,15 @@
 import logging
 import os
+import re
 from datetime import datetime
+import config
+
+# Правила Telegram: латиница, цифры и '_', начинается с буквы,
+# не заканчивается на '_' и не содержит '__'
+USERNAME_RE = re.compile(
+    r'[a-z](?:[a-z0-9]|_(?!_)){%d,%d}[a-z0-9]'
+    % (config.USERNAME_MIN_LENGTH - 2, config.USERNAME_MAX_LENGTH - 2)
+)
 
 def setup_logging():
     os.makedirs('logs', exist_ok=True)
@@ -25,3 +34,7 @@ def parse_username(username: str) -> str:
 
 def format_username(username: str) -> str:
     return f"@{parse_username(username)}"
+
+def is_valid_username(username: str) -> bool:
+    """Проверяет формат username без обращения к API (ожидает нормализованный username)"""
+    return USERNAME_RE.fullmatch(username) is not None